@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""ETag Benchmark for Webotron
+
+    Compares the original sequential calculate_etag with the current
+    implementation on large files. Files are sparse by default, which
+    measures hashing rather than disk speed; pass --random to write real
+    data and include reads from disk (and page cache) in the timing.
+
+    python benchmarks/etag.py --sizes 1,10,50 --dir /mnt/scratch
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from functools import reduce
+from hashlib import md5
+from pathlib import Path
+
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from webotron.bucket import BucketManager  # noqa: E402
+
+GB = 1024 ** 3
+
+
+def legacy_etag(path, chunk_size=BucketManager.CHUNK_SIZE):
+    """calculate_etag as it was before the parallel path"""
+    hashes = []
+    with open(path, 'rb') as p:
+        while True:
+            data = p.read(chunk_size)
+            if not data:
+                break
+            h = md5()
+            h.update(data)
+            hashes.append(h)
+    if not hashes:
+        return
+    elif len(hashes) == 1:
+        return hashes[0].hexdigest()
+    red = reduce(lambda x, y: x + y, (h.digest() for h in hashes))
+    return "{0}-{1}".format(md5(red).hexdigest(), len(hashes))
+
+
+class Workers:
+    """Stand-in for the client factory, only the worker count is used"""
+
+    session = None
+    TRANSFER_CONCURRENCY = 10
+
+    def __init__(self, workers):
+        self.workers = workers
+
+
+def make_file(directory, size, random_data):
+    """Create a file of size bytes"""
+    fd, name = tempfile.mkstemp(dir=directory, suffix='.bin')
+    with os.fdopen(fd, 'wb') as f:
+        if random_data:
+            block = os.urandom(BucketManager.CHUNK_SIZE)
+            for _ in range(size // len(block)):
+                f.write(block)
+            f.write(block[:size % len(block)])
+        else:
+            f.truncate(size)
+    return name
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--sizes', default='1,5,10,50', help="Comma separated file sizes in GB")
+@click.option('--dir', 'directory', default=None, help="Directory for the generated files")
+@click.option('--workers', default=os.cpu_count(), help="Hashing threads")
+@click.option('--random', 'random_data', default=False, is_flag=True, help="Write random data instead of sparse files")
+@click.option('--skip-legacy', default=False, is_flag=True, help="Only time the current implementation")
+def etag(sizes, directory, workers, random_data, skip_legacy):
+    """Benchmark ETag calculation on large files"""
+    manager = BucketManager(Workers(workers),
+                            region_cache=os.path.join(tempfile.gettempdir(), 'webotron-bench-regions.json'))
+    results = []
+    for size_gb in [float(s) for s in sizes.split(',')]:
+        path = make_file(directory, int(size_gb * GB), random_data)
+        try:
+            current, current_s = timed(manager.calculate_etag, path)
+            result = {'size_gb': size_gb, 'etag': current,
+                      'current_s': current_s,
+                      'current_mb_s': size_gb * 1024 / current_s}
+            if not skip_legacy:
+                legacy, legacy_s = timed(legacy_etag, path)
+                result.update({'legacy_s': legacy_s,
+                               'legacy_mb_s': size_gb * 1024 / legacy_s,
+                               'speedup': legacy_s / current_s,
+                               'match': legacy == current})
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+        finally:
+            os.remove(path)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    etag()
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""In-process S3 Stand-in for Benchmarks
+
+    Answers S3 calls from an in-memory store by hooking botocore events,
+    so no request ever leaves the process. Latency can be injected per
+    call and per megabyte to mimic a real endpoint.
+"""
+
+import io
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from datetime import timezone
+from hashlib import md5
+
+
+class Response:
+    """Minimal HTTP response botocore accepts from a before-call hook"""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+        self.raw = None
+
+
+class S3Stub:
+    """In-memory S3 answering requests made through a boto3 session"""
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, latency=0.0, seconds_per_mb=0.0, keep_data=False):
+        """Creates an S3Stub object"""
+        self.latency = latency
+        self.seconds_per_mb = seconds_per_mb
+        self.keep_data = keep_data
+        self.buckets = {}
+        self.uploads = {}
+        self.regions = {}
+        self.calls = Counter()
+        self.bytes_in = 0
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        """Route every S3 call made from session to the stub"""
+        session.events.register('before-parameter-build.s3', self._save_params)
+        session.events.register('before-call.s3', self._handle)
+
+    @staticmethod
+    def _save_params(params, context, **kwargs):
+        context['stub_params'] = dict(params)
+
+    def _handle(self, model, context, **kwargs):
+        params = context['stub_params']
+        with self._lock:
+            self.calls[model.name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, 'op_' + model.name, None)
+        if handler is None:
+            return Response(), {}
+        return handler(params)
+
+    @staticmethod
+    def error(code, status=404):
+        return Response(status), {'Error': {'Code': code, 'Message': code}}
+
+    def _read(self, body):
+        data = body if isinstance(body, (bytes, bytearray)) else body.read()
+        with self._lock:
+            self.bytes_in += len(data)
+        if self.seconds_per_mb:
+            time.sleep(len(data) / 1048576 * self.seconds_per_mb)
+        return data
+
+    def _bucket(self, name):
+        with self._lock:
+            return self.buckets.setdefault(name, {})
+
+    def _put(self, bucket, key, etag, data, size, extra):
+        obj = {'ETag': etag, 'Size': size, 'LastModified': datetime.now(timezone.utc)}
+        obj.update(extra)
+        if self.keep_data:
+            obj['Body'] = bytes(data)
+        with self._lock:
+            self.buckets.setdefault(bucket, {})[key] = obj
+
+    def op_ListBuckets(self, params):
+        return Response(), {'Buckets': [
+            {'Name': name, 'CreationDate': datetime.now(timezone.utc)}
+            for name in sorted(self.buckets)]}
+
+    def op_CreateBucket(self, params):
+        self._bucket(params['Bucket'])
+        config = params.get('CreateBucketConfiguration') or {}
+        self.regions[params['Bucket']] = config.get('LocationConstraint')
+        return Response(), {}
+
+    def op_DeleteBucket(self, params):
+        with self._lock:
+            self.buckets.pop(params['Bucket'], None)
+        return Response(), {}
+
+    def op_GetBucketLocation(self, params):
+        if params['Bucket'] not in self.buckets:
+            return self.error('NoSuchBucket')
+        return Response(), {'LocationConstraint': self.regions.get(params['Bucket'])}
+
+    def op_GetBucketWebsite(self, params):
+        return self.error('NoSuchWebsiteConfiguration')
+
+    def _list(self, params, marker):
+        bucket = self._bucket(params['Bucket'])
+        prefix = params.get('Prefix', '')
+        delimiter = params.get('Delimiter')
+        with self._lock:
+            keys = sorted(k for k in bucket if k.startswith(prefix) and k > marker)
+        limit = min(params.get('MaxKeys', self.PAGE_SIZE), self.PAGE_SIZE)
+        page, prefixes = [], []
+        for k in keys:
+            if len(page) + len(prefixes) == limit:
+                break
+            if delimiter and delimiter in k[len(prefix):]:
+                common = k[:k.index(delimiter, len(prefix)) + len(delimiter)]
+                if not prefixes or prefixes[-1] != common:
+                    prefixes.append(common)
+                continue
+            page.append(k)
+        last = max(page[-1:] + [p + '\uffff' for p in prefixes[-1:]] or [marker])
+        contents = [{'Key': k, 'ETag': '"%s"' % bucket[k]['ETag'], 'Size': bucket[k]['Size'],
+                     'LastModified': bucket[k]['LastModified']} for k in page]
+        return last, contents, [{'Prefix': p} for p in prefixes], any(k > last for k in keys)
+
+    def op_ListObjectsV2(self, params):
+        last, contents, prefixes, truncated = self._list(
+            params, params.get('ContinuationToken') or params.get('StartAfter', ''))
+        response = {'Contents': contents, 'CommonPrefixes': prefixes,
+                    'KeyCount': len(contents) + len(prefixes), 'IsTruncated': truncated}
+        if truncated:
+            response['NextContinuationToken'] = last
+        return Response(), response
+
+    def op_ListObjects(self, params):
+        last, contents, prefixes, truncated = self._list(params, params.get('Marker', ''))
+        response = {'Contents': contents, 'CommonPrefixes': prefixes, 'IsTruncated': truncated}
+        if truncated:
+            response['NextMarker'] = last
+        return Response(), response
+
+    def op_PutObject(self, params):
+        data = self._read(params.get('Body', b''))
+        self._put(params['Bucket'], params['Key'], md5(data).hexdigest(), data,
+                  len(data), {'ContentType': params.get('ContentType')})
+        return Response(), {'ETag': '"%s"' % md5(data).hexdigest()}
+
+    def _source(self, params):
+        source = params['CopySource']
+        if isinstance(source, str):
+            bucket, key = source.lstrip('/').split('/', 1)
+            source = {'Bucket': bucket, 'Key': key}
+        return self.buckets.get(source['Bucket'], {}).get(source['Key'])
+
+    def op_HeadObject(self, params):
+        obj = self.buckets.get(params['Bucket'], {}).get(params['Key'])
+        if obj is None:
+            return self.error('404')
+        if params.get('IfMatch') and params['IfMatch'].strip('"') != obj['ETag']:
+            return self.error('412', 412)
+        if params.get('PartNumber'):
+            sizes = obj.get('PartSizes') or [obj['Size']]
+            if params['PartNumber'] > len(sizes):
+                return self.error('416', 416)
+            return Response(206), {'ETag': '"%s"' % obj['ETag'], 'PartsCount': len(sizes),
+                                   'ContentLength': sizes[params['PartNumber'] - 1]}
+        return Response(), {'ETag': '"%s"' % obj['ETag'], 'ContentLength': obj['Size'],
+                            'ContentType': obj.get('ContentType') or 'binary/octet-stream',
+                            'Metadata': obj.get('Metadata', {})}
+
+    def op_GetObject(self, params):
+        from botocore.response import StreamingBody
+        obj = self.buckets.get(params['Bucket'], {}).get(params['Key'])
+        if obj is None:
+            return self.error('NoSuchKey')
+        if params.get('IfMatch') and params['IfMatch'].strip('"') != obj['ETag']:
+            return self.error('PreconditionFailed', 412)
+        data = obj.get('Body', b'')
+        if params.get('Range'):
+            start, end = (int(n) for n in params['Range'].split('=')[1].split('-'))
+            data = data[start:end + 1]
+        if self.seconds_per_mb:
+            time.sleep(len(data) / 1048576 * self.seconds_per_mb)
+        return Response(206 if params.get('Range') else 200), {
+            'ETag': '"%s"' % obj['ETag'], 'ContentLength': len(data),
+            'Body': StreamingBody(io.BytesIO(data), len(data))}
+
+    def op_CopyObject(self, params):
+        obj = self._source(params)
+        if obj is None:
+            return self.error('NoSuchKey')
+        data = obj.get('Body', b'')
+        self._put(params['Bucket'], params['Key'], md5(data).hexdigest() if self.keep_data else obj['ETag'],
+                  data, obj['Size'], {'ContentType': obj.get('ContentType')})
+        return Response(), {'CopyObjectResult': {'ETag': '"%s"' % obj['ETag']}}
+
+    def op_UploadPartCopy(self, params):
+        upload = self.uploads.get(params['UploadId'])
+        obj = self._source(params)
+        if upload is None or obj is None:
+            return self.error('NoSuchUpload')
+        start, end = (int(n) for n in params['CopySourceRange'].split('=')[1].split('-'))
+        data = obj.get('Body', b'')[start:end + 1]
+        etag = md5(data).hexdigest()
+        with self._lock:
+            upload['Parts'][params['PartNumber']] = (etag, data, end + 1 - start)
+        return Response(), {'CopyPartResult': {'ETag': '"%s"' % etag}}
+
+    def op_DeleteObjects(self, params):
+        bucket = self._bucket(params['Bucket'])
+        with self._lock:
+            for obj in params['Delete']['Objects']:
+                bucket.pop(obj['Key'], None)
+        return Response(), {}
+
+    def op_CreateMultipartUpload(self, params):
+        with self._lock:
+            upload_id = 'upload-{0}'.format(len(self.uploads) + sum(self.calls.values()))
+            self.uploads[upload_id] = {
+                'Bucket': params['Bucket'], 'Key': params['Key'], 'Parts': {},
+                'ContentType': params.get('ContentType'),
+                'Initiated': datetime.now(timezone.utc)}
+        return Response(), {'UploadId': upload_id}
+
+    def op_UploadPart(self, params):
+        upload = self.uploads.get(params['UploadId'])
+        if upload is None:
+            return self.error('NoSuchUpload')
+        data = self._read(params['Body'])
+        etag = md5(data).hexdigest()
+        with self._lock:
+            upload['Parts'][params['PartNumber']] = (etag, data if self.keep_data else b'', len(data))
+        return Response(), {'ETag': '"%s"' % etag}
+
+    def op_ListParts(self, params):
+        upload = self.uploads.get(params['UploadId'])
+        if upload is None:
+            return self.error('NoSuchUpload')
+        return Response(), {'Parts': [
+            {'PartNumber': n, 'ETag': '"%s"' % p[0], 'Size': p[2]}
+            for n, p in sorted(upload['Parts'].items())], 'IsTruncated': False}
+
+    def op_ListMultipartUploads(self, params):
+        return Response(), {'Uploads': [
+            {'Key': u['Key'], 'UploadId': upload_id, 'Initiated': u['Initiated']}
+            for upload_id, u in list(self.uploads.items())
+            if u['Bucket'] == params['Bucket']], 'IsTruncated': False}
+
+    def op_AbortMultipartUpload(self, params):
+        with self._lock:
+            self.uploads.pop(params['UploadId'], None)
+        return Response(), {}
+
+    def op_CompleteMultipartUpload(self, params):
+        with self._lock:
+            upload = self.uploads.pop(params['UploadId'], None)
+        if upload is None:
+            return self.error('NoSuchUpload')
+        parts = [upload['Parts'][p['PartNumber']]
+                 for p in params['MultipartUpload']['Parts']]
+        digest = md5(b''.join(bytes.fromhex(p[0]) for p in parts)).hexdigest()
+        data = b''.join(p[1] for p in parts)
+        self._put(upload['Bucket'], upload['Key'], '{0}-{1}'.format(digest, len(parts)),
+                  data, sum(p[2] for p in parts), {'ContentType': upload['ContentType'],
+                                                   'PartSizes': [p[2] for p in parts]})
+        return Response(), {}
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Startup Benchmark for Webotron
+
+    Measures how long webotron takes to import and how long it takes
+    from process start until the first AWS request is ready to send.
+    Each measurement runs in a fresh interpreter so module caches do not
+    hide regressions. Exits non-zero when a threshold is exceeded.
+
+    python benchmarks/startup.py --runs 10 --max-import-ms 150
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SCRIPT = """
+import time
+t0 = time.perf_counter()
+import webotron.webotron
+print('elapsed', time.perf_counter() - t0)
+"""
+
+FIRST_REQUEST_SCRIPT = """
+import sys
+import time
+t0 = time.perf_counter()
+from webotron import clients
+from webotron import webotron
+
+
+class Response:
+    status_code = 200
+
+
+def first_request(**kwargs):
+    print('elapsed', time.perf_counter() - t0)
+    return Response(), {'Buckets': []}
+
+
+clients.configure(region_name='us-east-1',
+                  aws_access_key_id='bench',
+                  aws_secret_access_key='bench')
+clients.get_factory().session.events.register(
+    'before-call.s3.ListBuckets', first_request)
+webotron.cli(['--region-cache', sys.argv[1], '--upload-state', sys.argv[2],
+              'buckets', 'list'], standalone_mode=False)
+"""
+
+HELP_SCRIPT = """
+import time
+t0 = time.perf_counter()
+from webotron import webotron
+webotron.cli(['--help'], standalone_mode=False)
+print('elapsed', time.perf_counter() - t0)
+"""
+
+
+def run_script(script, *args):
+    """Run a script in a fresh interpreter and return its elapsed time in ms"""
+    result = subprocess.run(
+        [sys.executable, '-c', script] + list(args),
+        cwd=str(ROOT),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True)
+    for line in result.stdout.splitlines():
+        if line.startswith('elapsed '):
+            return float(line.split()[1]) * 1000
+    raise click.ClickException("No timing reported by benchmark script")
+
+
+def measure(script, runs, *args):
+    """Median of several runs in ms"""
+    return statistics.median(run_script(script, *args) for _ in range(runs))
+
+
+@click.command()
+@click.option('--runs', default=5, help="Interpreter launches per measurement")
+@click.option('--max-import-ms', default=None, type=float, help="Fail if import time exceeds this")
+@click.option('--max-help-ms', default=None, type=float, help="Fail if --help time exceeds this")
+@click.option('--max-first-request-ms', default=None, type=float, help="Fail if time to first request exceeds this")
+@click.option('--baseline', default=None, type=click.Path(exists=True), help="JSON results from a previous run")
+@click.option('--tolerance', default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%)")
+def startup(runs, max_import_ms, max_help_ms, max_first_request_ms, baseline, tolerance):
+    """Benchmark webotron import and time to first request"""
+    # The CLI keeps its region cache and upload state in a scratch
+    # directory so runs never touch the user's ~/.webotron
+    with tempfile.TemporaryDirectory(prefix='webotron-bench-') as scratch:
+        results = {
+            'import_ms': measure(IMPORT_SCRIPT, runs),
+            'help_ms': measure(HELP_SCRIPT, runs),
+            'first_request_ms': measure(FIRST_REQUEST_SCRIPT, runs,
+                                        os.path.join(scratch, 'regions.json'),
+                                        os.path.join(scratch, 'uploads.json')),
+        }
+    print(json.dumps(results, indent=2))
+
+    limits = {
+        'import_ms': max_import_ms,
+        'help_ms': max_help_ms,
+        'first_request_ms': max_first_request_ms,
+    }
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+        for name, value in previous.items():
+            allowed = value * (1 + tolerance)
+            if name in limits and (limits[name] is None or allowed < limits[name]):
+                limits[name] = allowed
+
+    failed = [name for name, limit in limits.items()
+              if limit is not None and results[name] > limit]
+    for name in failed:
+        print("{0} regressed: {1:.1f} ms > {2:.1f} ms".format(
+            name, results[name], limits[name]), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    startup()
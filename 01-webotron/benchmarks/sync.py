@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Sync Benchmark for Webotron
+
+    Generates a synthetic site, then times BucketManager.sync_path,
+    load_manifest and delete_bucket against the in-process S3 stand-in in
+    s3stub.py. Results are printed as JSON so runs can be compared across
+    commits.
+
+    python benchmarks/sync.py --files 5000 --sizes lognormal --change-ratio 0.1 --latency 0.02
+"""
+
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import boto3
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from s3stub import S3Stub  # noqa: E402
+from webotron.bucket import BucketManager  # noqa: E402
+from webotron.clients import ClientFactory  # noqa: E402
+
+BUCKET = 'bench.webotron.local'
+
+EXTENSIONS = ['.html', '.css', '.js', '.png', '.jpg', '.json', '.mp4']
+
+SIZE_DISTRIBUTIONS = {
+    'fixed': lambda rng, mean: mean,
+    'uniform': lambda rng, mean: rng.randint(0, 2 * mean),
+    'lognormal': lambda rng, mean: int(rng.lognormvariate(0, 1.5) * mean / 3.08),
+    'pareto': lambda rng, mean: int((rng.paretovariate(1.5) - 1) * mean / 2),
+}
+
+
+def generate_tree(root, files, distribution, mean_size, depth, seed):
+    """Write a synthetic site, returns the list of file paths"""
+    rng = random.Random(seed)
+    paths = []
+    for n in range(files):
+        folder = Path(root, *['dir{0}'.format(rng.randint(0, 9)) for _ in range(rng.randint(0, depth))])
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / 'file{0}{1}'.format(n, rng.choice(EXTENSIONS))
+        size = max(0, SIZE_DISTRIBUTIONS[distribution](rng, mean_size))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def change_tree(paths, ratio, seed):
+    """Rewrite, add and remove a ratio of files, returns bytes changed"""
+    rng = random.Random(seed + 1)
+    changed = 0
+    for path in rng.sample(paths, int(len(paths) * ratio)):
+        action = rng.choice(('modify', 'modify', 'add', 'remove'))
+        if action == 'remove':
+            path.unlink()
+            continue
+        if action == 'add':
+            path = path.with_name('new-' + path.name)
+        data = os.urandom(max(1, path.stat().st_size if path.exists() else 1024))
+        path.write_bytes(data)
+        changed += len(data)
+    return changed
+
+
+def tree_size(root):
+    files = [p for p in Path(root).rglob('*') if p.is_file()]
+    return len(files), sum(p.stat().st_size for p in files)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform != 'darwin' else rss / 1048576
+
+
+def new_manager(stub, workers):
+    session = boto3.Session(region_name='us-east-1',
+                            aws_access_key_id='bench', aws_secret_access_key='bench')
+    stub.install(session)
+    manager = BucketManager(ClientFactory(session, workers=workers),
+                            upload_state=os.path.join(tempfile.gettempdir(), 'webotron-bench-uploads.json'),
+                            region_cache=os.path.join(tempfile.gettempdir(), 'webotron-bench-regions.json'))
+    manager.s3
+    return manager
+
+
+def run_phase(name, stub, func, files=0, size=0):
+    """Time func and report throughput and the API calls it made"""
+    calls_before = stub.calls.copy()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        func()
+    elapsed = time.perf_counter() - start
+    calls = stub.calls - calls_before
+    return {
+        'phase': name,
+        'seconds': round(elapsed, 4),
+        'files_per_s': round(files / elapsed, 2) if files else None,
+        'mb_per_s': round(size / 1048576 / elapsed, 2) if size else None,
+        'api_calls': dict(calls),
+        'api_call_total': sum(calls.values()),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+@click.command()
+@click.option('--files', default=1000, help="Number of files in the synthetic tree")
+@click.option('--sizes', 'distribution', default='lognormal', type=click.Choice(sorted(SIZE_DISTRIBUTIONS)), help="File size distribution")
+@click.option('--mean-size', default=65536, help="Mean file size in bytes")
+@click.option('--depth', default=3, help="Maximum folder depth")
+@click.option('--change-ratio', default=0.1, help="Ratio of files changed before the incremental sync")
+@click.option('--workers', default=8, help="Worker threads")
+@click.option('--latency', default=0.0, help="Seconds added to every S3 call")
+@click.option('--seconds-per-mb', default=0.0, help="Seconds added per MB sent to S3")
+@click.option('--seed', default=42, help="Random seed for the tree")
+@click.option('--output', default=None, type=click.Path(), help="Also write results to this JSON file")
+def sync(files, distribution, mean_size, depth, change_ratio, workers, latency, seconds_per_mb, seed, output):
+    """Benchmark sync_path, load_manifest and delete_bucket offline"""
+    stub = S3Stub(latency=latency, seconds_per_mb=seconds_per_mb)
+    root = tempfile.mkdtemp(prefix='webotron-bench-')
+    try:
+        paths = generate_tree(root, files, distribution, mean_size, depth, seed)
+        count, size = tree_size(root)
+        manager = new_manager(stub, workers)
+        phases = [run_phase('initial_sync', stub,
+                            lambda: manager.sync_path(root, BUCKET, True),
+                            count, size)]
+
+        changed = change_tree(paths, change_ratio, seed)
+        count, _ = tree_size(root)
+        manager = new_manager(stub, workers)
+        phases.append(run_phase('incremental_sync', stub,
+                                lambda: manager.sync_path(root, BUCKET, True),
+                                count, changed))
+
+        manager = new_manager(stub, workers)
+        phases.append(run_phase('load_manifest', stub,
+                                lambda: manager.load_manifest(manager.get_bucket(BUCKET)),
+                                count))
+        manager = new_manager(stub, workers)
+        phases.append(run_phase('delete_bucket', stub,
+                                lambda: manager.delete_bucket(BUCKET, None, None),
+                                count))
+    finally:
+        shutil.rmtree(root)
+
+    results = {
+        'config': {'files': files, 'sizes': distribution, 'mean_size': mean_size,
+                   'change_ratio': change_ratio, 'workers': workers,
+                   'latency': latency, 'seconds_per_mb': seconds_per_mb, 'seed': seed},
+        'tree': {'files': files, 'bytes': size},
+        'phases': phases,
+    }
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    sync()
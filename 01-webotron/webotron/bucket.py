@@ -1,41 +1,150 @@
 # -*- code utf-8 -*-
 
 """Classes for S3 Buckets"""
-import boto3
+import boto3.s3.transfer
 from botocore.exceptions import ClientError
 import mimetypes
 from pathlib import Path
 from hashlib import md5
 import io
 from webotron import util
-from functools import reduce
+from webotron.resume import ResumableUploader
+from webotron.resume import UploadState
+from webotron.output import console
+from webotron.regions import RegionCache
+from webotron.stats import run_stats
+from webotron.throttle import ConcurrencyController
+from webotron.throttle import TokenBucket
+import heapq
+import mmap
+import os
+import queue
+import re
+import threading
+import time
 from math import floor
 from math import ceil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from fnmatch import fnmatch
+from operator import itemgetter
 
 
 class BucketManager:
     """Manage an S3 Bucket"""
 
     CHUNK_SIZE = 8388608
+    DELETE_BATCH_SIZE = 1000
+    ENTRY_POINTS = ('*.html', '*.htm')
+    PARTITION_DEPTH = 3
+    RESUME_THRESHOLD = 67108864
+    PARALLEL_HASH_THRESHOLD = 268435456
+    COPY_LIMIT = 5368709120
+    RANGE_BOUNDARIES = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+    MD5_ETAG = re.compile(r'^[0-9a-f]{32}(-[0-9]+)?$')
+    COPY_HEADERS = ('ContentType', 'CacheControl', 'ContentDisposition',
+                    'ContentEncoding', 'ContentLanguage', 'WebsiteRedirectLocation')
 
-    def __init__(self, session):
+    def __init__(self, clients, max_bandwidth=None, prefix_throttle=False, upload_state=None,
+                 region_cache=None, region_ttl=None):
         """Creates a BucketManger object"""
-        self.session = session
-        self.s3 = self.session.resource('s3')
+        self.clients = clients
+        self.session = clients.session
+        self.workers = clients.workers
+        self.controller = ConcurrencyController(
+            self.workers, per_prefix=prefix_throttle)
+        self.bandwidth = TokenBucket(max_bandwidth) if max_bandwidth else None
+        self.upload_state = UploadState(upload_state)
+        self.regions = RegionCache(region_cache, region_ttl)
+        self._transfer_config = None
         self.manifest = {}
+        self.manifests = {}
         self.local_manifest = {}
         self.delete_manifest = {}
-        self.transfer_config = boto3.s3.transfer.TransferConfig(
-            multipart_chunksize=self.CHUNK_SIZE,
-            multipart_threshold=self.CHUNK_SIZE
-        )
+        self.failed_uploads = []
+        self.part_sizes = {}
+
+    @property
+    def s3(self):
+        """S3 resource, backed by the shared S3 client"""
+        return self.clients.resource('s3')
+
+    @property
+    def transfer_config(self):
+        """Transfer configuration, created on first upload"""
+        if self._transfer_config is None:
+            self._transfer_config = boto3.s3.transfer.TransferConfig(
+                multipart_chunksize=self.CHUNK_SIZE,
+                multipart_threshold=self.CHUNK_SIZE,
+                max_concurrency=self.clients.TRANSFER_CONCURRENCY
+            )
+        return self._transfer_config
+
+    def uploader(self, bucket_name):
+        """Resumable uploader for files above RESUME_THRESHOLD"""
+        return ResumableUploader(
+            self.client_for(bucket_name), self.upload_state, self.CHUNK_SIZE,
+            concurrency=self.clients.TRANSFER_CONCURRENCY)
 
     def get_bucket_region(self, bucket):
         """Get the region for a bucket"""
-        bucket_region = self.s3.meta.client.get_bucket_location(
-            Bucket=bucket.name)
+        return self.bucket_region(bucket.name)
+
+    def bucket_region(self, bucket_name, save=True):
+        """Region of a bucket from the cache, looked up on a miss"""
+        region = self.regions.get(bucket_name)
+        if region is None:
+            bucket_region = self.s3.meta.client.get_bucket_location(
+                Bucket=bucket_name)
+            region = bucket_region["LocationConstraint"] or 'us-east-1'
+            self.regions.put(bucket_name, region, save=save)
+        return region
 
-        return bucket_region["LocationConstraint"] or 'us-east-1'
+    def bucket_regions(self, bucket_names):
+        """Regions for many buckets, looking up cache misses in parallel"""
+        def lookup(name):
+            try:
+                self.bucket_region(name, save=False)
+            except ClientError:
+                pass
+
+        missing = [name for name in bucket_names if self.regions.get(name) is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lookup, missing))
+            self.regions.save()
+        return {name: self.regions.get(name) for name in bucket_names}
+
+    def by_region(self, buckets):
+        """Group buckets by region, in a dictionary of region to buckets"""
+        regions = self.bucket_regions([b.name for b in buckets])
+        groups = {}
+        for b in buckets:
+            groups.setdefault(regions[b.name], []).append(b)
+        return groups
+
+    def client_for(self, bucket_name):
+        """S3 client local to the region of a bucket
+
+        Falls back to the default client for buckets whose region cannot be
+        looked up (not created yet, no permission) or is not in
+        util.region_endpoint.
+        """
+        try:
+            region = self.bucket_region(bucket_name)
+        except ClientError:
+            return self.s3.meta.client
+        if not util.known_region(region):
+            return self.s3.meta.client
+        return self.clients.client('s3', region)
+
+    def s3_for(self, bucket_name):
+        """S3 resource backed by the region-local client for a bucket"""
+        client = self.client_for(bucket_name)
+        if client is self.s3.meta.client:
+            return self.s3
+        return self.clients.resource('s3', client.meta.region_name)
 
     def get_bucket_url(self, bucket):
         """Get the website URL for bucket"""
@@ -43,15 +152,17 @@ class BucketManager:
 
     def all_buckets(self, region=None):
         """Get an iterator of all buckets"""
+        if region:
+            return self.by_region(list(self.s3.buckets.all())).get(region, [])
         return self.s3.buckets.all()
 
     def all_objects(self, bucket):
         """Get an iterator of all objects within a bucket"""
-        return self.s3.Bucket(bucket).objects.all()
+        return self.s3_for(bucket).Bucket(bucket).objects.all()
 
     def get_bucket(self, bucket_name):
         """Returns a Bucket Object"""
-        return self.s3.Bucket(bucket_name)
+        return self.s3_for(bucket_name).Bucket(bucket_name)
 
     def find_bucket(self, bucket_name, pattern_match, region=None):
         """Get all buckets that match pattern"""
@@ -76,12 +187,13 @@ class BucketManager:
                     CreateBucketConfiguration={
                         "LocationConstraint": region}
                 )
+                self.regions.put(bucket_name, region)
             else:
                 s3_bucket = self.s3.create_bucket(Bucket=bucket_name)
 
         except ClientError as e:
             if e.response['Error']['Code'] == "BucketAlreadyOwnedByYou":
-                s3_bucket = self.s3.Bucket(bucket_name)
+                s3_bucket = self.get_bucket(bucket_name)
             else:
                 raise e
         return s3_bucket
@@ -124,10 +236,11 @@ class BucketManager:
         """Get List of Local Objects and Hash"""
         for p in path.iterdir():
             if p.is_dir():
-                self.get_local_path(p, root, s3_bucket.name)
+                self.get_local_path(p, root, s3_bucket)
             if p and p.is_file():
                 self.local_manifest[str(p.relative_to(root))] = {
-                    "Path": str(p), "ETag": self.calculate_etag(p)}
+                    "Path": str(p), "ETag": self.calculate_etag(p),
+                    "Size": p.stat().st_size}
         return
 
     @staticmethod
@@ -144,129 +257,811 @@ class BucketManager:
         hash.update(data)
         return hash
 
-    def calculate_etag(self, path):
-        """For a given path, calculate the etag"""
+    def calculate_etag(self, path, part_size=None, multipart=False):
+        """For a given path, calculate the etag
+
+        With multipart the <md5>-<parts> form is returned even for a single
+        part, as S3 does for multipart uploads."""
+        part_size = part_size or self.CHUNK_SIZE
+        size = os.path.getsize(path)
+        run_stats.add('bytes_hashed', size)
+        if size > self.PARALLEL_HASH_THRESHOLD and size > part_size:
+            return self.calculate_etag_parallel(path, size, part_size)
+
         hashes = []
+        buffer = bytearray(part_size)
+        view = memoryview(buffer)
 
         with open(path, 'rb') as p:
             while True:
-                data = p.read(self.CHUNK_SIZE)
-                if not data:
+                length = p.readinto(buffer)
+                if not length:
                     break
-                hashes.append(self.hash_data(data))
+                hashes.append(self.hash_data(view[:length]))
 
+        if not hashes and multipart:
+            hashes = [md5()]
         if not hashes:
             return
-        elif len(hashes) == 1:
+        elif len(hashes) == 1 and not multipart:
             return hashes[0].hexdigest()
         else:
             # print("\n\tFile {0} has more than 1 part".format(path))
-            red = reduce(lambda x, y: x + y, (h.digest() for h in hashes))
+            red = b"".join(h.digest() for h in hashes)
             hash = "{0}-{1}".format(self.hash_data(red).hexdigest(),
                                     len(hashes))
             return hash
 
+    def calculate_etag_parallel(self, path, size, part_size=None):
+        """Calculate the etag of a large file by hashing its parts on several threads"""
+        part_size = part_size or self.CHUNK_SIZE
+        parts = ceil(size / part_size)
+        digests = bytearray(16 * parts)
+
+        def hash_parts(data, first, last):
+            for part in range(first, last):
+                start = part * part_size
+                digests[part * 16:(part + 1) * 16] = \
+                    md5(data[start:start + part_size]).digest()
+
+        with open(path, 'rb') as p, \
+                mmap.mmap(p.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            data = memoryview(m)
+            try:
+                step = ceil(parts / self.workers)
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = [executor.submit(hash_parts, data, first, min(first + step, parts))
+                               for first in range(0, parts, step)]
+                    for future in futures:
+                        future.result()
+            finally:
+                data.release()
+
+        return "{0}-{1}".format(md5(digests).hexdigest(), parts)
+
+    def calculate_md5(self, path):
+        """MD5 of a whole file, the ETag of an object uploaded in one request"""
+        run_stats.add('bytes_hashed', os.path.getsize(path))
+        digest = md5()
+        with open(path, 'rb') as p:
+            for chunk in iter(lambda: p.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def local_etag(self, path, etag, part_size=None):
+        """ETag of path computed the way the object behind etag was uploaded
+
+        part_size is the size of the parts of a multipart object. None when
+        etag is not an MD5 of the content or the part size is not known and
+        it cannot be compared."""
+        if not self.MD5_ETAG.match(etag):
+            return None
+        if '-' not in etag:
+            return self.calculate_md5(path)
+        if part_size is None:
+            return None
+        return self.calculate_etag(path, part_size, multipart=True)
+
     def load_manifest(self, s3_bucket):
         """Load Paginator Manifest for Caching Purposes"""
-        paginator = self.s3.meta.client.get_paginator('list_objects_v2')
-        for page in paginator.paginate(Bucket=s3_bucket.name):
-            for obj in page.get('Contents', []):
-                self.manifest[obj['Key']] = str(obj['ETag']).replace('"', '')
+        self.manifest.update(self.fetch_manifest(s3_bucket))
+        return
+
+    def fetch_manifest(self, s3_bucket):
+        """Returns a dictionary of key to ETag for every object in a bucket"""
+        return {k: obj['ETag'] for k, obj in self.fetch_objects(s3_bucket).items()}
+
+    def fetch_objects(self, s3_bucket):
+        """Returns a dictionary of key to ETag and Size for every object in a bucket"""
+        objects = {}
+        for obj in self.stream_objects(s3_bucket.name, ordered=False):
+            objects[obj['Key']] = {
+                'ETag': str(obj['ETag']).replace('"', ''), 'Size': obj['Size']}
+        return objects
+
+    def list_pages(self, bucket_name, prefix='', delimiter=None, start_after=None):
+        """Yield pages of list_objects_v2 for a prefix"""
+        client = self.client_for(bucket_name)
+        params = {'Bucket': bucket_name, 'Prefix': prefix}
+        if delimiter:
+            params['Delimiter'] = delimiter
+        if start_after:
+            params['StartAfter'] = start_after
+        while True:
+            page = self.controller.call(client.list_objects_v2, key=prefix, **params)
+            yield page
+            if not page.get('IsTruncated'):
+                break
+            params['ContinuationToken'] = page['NextContinuationToken']
+
+    def list_range(self, bucket_name, prefix, start_after=None, end=None):
+        """Yield the objects of each page under prefix after start_after, up to and including end"""
+        for page in self.list_pages(bucket_name, prefix, start_after=start_after):
+            contents = page.get('Contents', [])
+            if end is not None and contents and contents[-1]['Key'] > end:
+                yield [c for c in contents if c['Key'] <= end]
+                return
+            yield contents
+
+    def key_ranges(self, prefix, last_key):
+        """Split the keys under prefix after last_key into ranges on their next character"""
+        bounds = [prefix + c for c in self.RANGE_BOUNDARIES if prefix + c > last_key]
+        bounds = bounds[::max(1, ceil(len(bounds) / self.workers))]
+        return [(prefix, start, end)
+                for start, end in zip([last_key] + bounds, bounds + [None])]
+
+    def stream_objects(self, bucket_name, prefix='', ordered=True):
+        """Yield every object under prefix, listing parts of it on parallel workers
+
+        Prefixes are split on '/' one level at a time until there are enough
+        of them to keep the workers busy, then each one is listed flat. A
+        prefix with no sub-prefixes that runs past one page is split into key
+        ranges on the next character instead. Pages are handed over through
+        bounded queues, and only a few parts are listed ahead of the one being
+        read, so the full listing is never held in memory. With ordered the
+        objects come in key order, otherwise in the order pages arrive.
+        """
+        units = [(prefix, None, None)]
+        direct = []
+        for _ in range(self.PARTITION_DEPTH):
+            if len(units) >= self.workers:
+                break
+            split = []
+            for unit in units:
+                if unit[1] is not None:
+                    split.append(unit)
+                    continue
+                for page in self.list_pages(bucket_name, unit[0], delimiter='/'):
+                    if ordered:
+                        direct.extend(page.get('Contents', []))
+                    else:
+                        yield from page.get('Contents', [])
+                    if page.get('IsTruncated') and not page.get('CommonPrefixes'):
+                        split.extend(self.key_ranges(unit[0], page['Contents'][-1]['Key']))
+                        break
+                    split.extend((c['Prefix'], None, None) for c in page.get('CommonPrefixes', []))
+            units = split
+        direct.sort(key=itemgetter('Key'))
+
+        shared = None if ordered else queue.Queue(maxsize=self.workers * 4)
+        stop = threading.Event()
+
+        def put(pages, item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def list_unit(unit, pages):
+            try:
+                for contents in self.list_range(bucket_name, *unit):
+                    if stop.is_set():
+                        break
+                    put(pages, contents)
+            finally:
+                put(pages, None)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            listing = deque()
+            remaining = iter(units)
+
+            def submit():
+                unit = next(remaining, None)
+                if unit is not None:
+                    pages = shared if shared is not None else queue.Queue(maxsize=4)
+                    futures.append(executor.submit(list_unit, unit, pages))
+                    listing.append(pages)
+
+            def objects():
+                while listing:
+                    contents = listing[0].get()
+                    if contents is None:
+                        listing.popleft()
+                        submit()
+                        continue
+                    yield from contents
+
+            for _ in range(self.workers * 2):
+                submit()
+            try:
+                if ordered:
+                    yield from heapq.merge(direct, objects(), key=itemgetter('Key'))
+                else:
+                    yield from objects()
+            finally:
+                stop.set()
+            for future in futures:
+                future.result()
+
+    def disk_usage(self, bucket_name, depth=1, prefix=''):
+        """Returns object count and total size per prefix, cut at depth levels of '/'"""
+        usage = {}
+        for obj in self.stream_objects(bucket_name, prefix, ordered=False):
+            folders = obj['Key'][len(prefix):].split('/')[:-1][:depth]
+            key = prefix + ''.join(folder + '/' for folder in folders)
+            entry = usage.setdefault(key, [0, 0])
+            entry[0] += 1
+            entry[1] += obj['Size']
+        return usage
+
+    def object_part_size(self, bucket_name, key, obj):
+        """Size of the first part of a multipart object, read once per object version
+
+        Other tools pick their own part sizes, so S3 is asked rather than
+        guessing. None for single part objects or when S3 does not say."""
+        if '-' not in obj['ETag']:
+            return None
+        cache_key = (bucket_name, key, obj['ETag'])
+        if cache_key not in self.part_sizes:
+            try:
+                head = self.controller.call(
+                    self.client_for(bucket_name).head_object, key=key, Bucket=bucket_name,
+                    Key=key, PartNumber=1, IfMatch='"{0}"'.format(obj['ETag']))
+                self.part_sizes[cache_key] = head['ContentLength']
+            except ClientError:
+                self.part_sizes[cache_key] = None
+        return self.part_sizes[cache_key]
+
+    def delete_keys(self, s3_bucket, keys):
+        """Delete keys from a bucket in parallel batches"""
+        client = self.client_for(s3_bucket.name)
+        batches = [keys[i:i + self.DELETE_BATCH_SIZE]
+                   for i in range(0, len(keys), self.DELETE_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            deletes = [executor.submit(
+                self.controller.call,
+                client.delete_objects,
+                key=batch[0],
+                Bucket=s3_bucket.name,
+                Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+                for batch in batches]
+            for delete in deletes:
+                delete.result()
         return
 
     def upload_file(self, s3_bucket, path, key):
         """Upload local file to S3 Bucket"""
-        print("\t📄    ✅    " + key + (" " * (90 - len(key))) + "📄\n")
+        content_type = mimetypes.guess_type(key)[0] or 'text/plain'
+        size = Path(path).stat().st_size
+        if size > self.RESUME_THRESHOLD and self.uploader(s3_bucket.name).can_upload(size):
+            self.controller.call(
+                self.uploader(s3_bucket.name).upload,
+                path,
+                s3_bucket.name,
+                key,
+                key=key,
+                extra_args={'ContentType': content_type},
+                callback=self.bandwidth
+            )
+        else:
+            self.controller.call(
+                self.client_for(s3_bucket.name).upload_file,
+                path,
+                s3_bucket.name,
+                key,
+                key=key,
+                ExtraArgs={'ContentType': content_type},
+                Callback=self.bandwidth,
+                Config=self.transfer_config
+            )
+        run_stats.add('bytes_uploaded', size)
+        run_stats.add('files_uploaded')
+        console.item("upload", key, "\t📄    ✅    " + key + (" " * (90 - len(key))) + "📄\n",
+                     size=size, bucket=s3_bucket.name)
+        return
 
+    def fan_out_file(self, s3_buckets, path, key):
+        """Upload local file to several S3 Buckets, reading it from disk once"""
         content_type = mimetypes.guess_type(key)[0] or 'text/plain'
-        s3_bucket.upload_file(
-            path,
-            key,
-            ExtraArgs={'ContentType': content_type},
-            Config=self.transfer_config
-        )
+        size = Path(path).stat().st_size
+        names = [b.name for b in s3_buckets]
+        clients = {name: self.client_for(name) for name in names}
+
+        def send(method, **params):
+            if self.bandwidth:
+                self.bandwidth(len(params['Body']))
+            return self.controller.call(method, key=key, Key=key, **params)
+
+        # Up to TRANSFER_CONCURRENCY parts are read ahead, each sent to every
+        # bucket, so every bucket has that many parts in flight
+        concurrency = self.clients.TRANSFER_CONCURRENCY
+        with open(path, 'rb') as f, \
+                ThreadPoolExecutor(max_workers=len(names) * concurrency) as executor:
+            if size <= self.CHUNK_SIZE:
+                data = f.read()
+                for future in [executor.submit(send, clients[name].put_object, Bucket=name, Body=data,
+                                               ContentType=content_type) for name in names]:
+                    future.result()
+            else:
+                upload_ids = {}
+                parts = {name: [] for name in names}
+                in_flight = deque()
+                try:
+                    for name in names:
+                        upload_ids[name] = clients[name].create_multipart_upload(
+                            Bucket=name, Key=key, ContentType=content_type)['UploadId']
+                    part_number = 1
+                    while True:
+                        data = f.read(self.CHUNK_SIZE)
+                        if data:
+                            in_flight.append((part_number, {name: executor.submit(
+                                send, clients[name].upload_part, Bucket=name, UploadId=upload_ids[name],
+                                PartNumber=part_number, Body=data) for name in names}))
+                            part_number += 1
+                        elif not in_flight:
+                            break
+                        if len(in_flight) >= concurrency or not data:
+                            number, futures = in_flight.popleft()
+                            for name, future in futures.items():
+                                parts[name].append(
+                                    {'PartNumber': number, 'ETag': future.result()['ETag']})
+                    for name in names:
+                        clients[name].complete_multipart_upload(
+                            Bucket=name, Key=key, UploadId=upload_ids[name],
+                            MultipartUpload={'Parts': parts[name]})
+                except Exception:
+                    pending = [future for _, futures in in_flight for future in futures.values()]
+                    for future in pending:
+                        future.cancel()
+                    wait(pending)
+                    for name, upload_id in upload_ids.items():
+                        try:
+                            clients[name].abort_multipart_upload(Bucket=name, Key=key, UploadId=upload_id)
+                        except ClientError:
+                            pass
+                    raise
+
+        run_stats.add('bytes_uploaded', size * len(names))
+        run_stats.add('files_uploaded', len(names))
+        console.item("upload", key, "\t📄    ✅    " + key + (" " * (90 - len(key))) + "📄\n",
+                     size=size, bucket=",".join(names))
         return
 
-    def sync_path(self, pathname, bucket_name, delete):
-        """Synchronize Local Path to S3 Bucket"""
-        print("\t" + ("📄    "*21)+"\n")
+    def is_entry_point(self, key, entry_points=None):
+        """True if key is a page that should go live after its assets"""
+        return any(fnmatch(key, pattern)
+                   for pattern in (entry_points or self.ENTRY_POINTS))
+
+    def abort_stale_uploads(self, s3_bucket):
+        """Abort abandoned multipart uploads of the files being synced to a bucket"""
+        try:
+            aborted = self.uploader(s3_bucket.name).abort_stale(s3_bucket.name, self.local_manifest)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'AccessDenied':
+                raise e
+            console.message("\t📄    ⚠️    Cannot list multipart uploads in {0}, stale uploads were kept\n".format(
+                s3_bucket.name), event="abort_upload_denied", bucket=s3_bucket.name)
+            return
+        for key in aborted:
+            console.item("abort_upload", key,
+                         "\t📄    🧹    " + key + (" " * (90 - len(key))) + "📄\n", bucket=s3_bucket.name)
+
+    def upload_to(self, s3_buckets, path, key):
+        """Upload local file to one or more S3 Buckets"""
+        if len(s3_buckets) == 1:
+            return self.upload_file(s3_buckets[0], path, key)
+        return self.fan_out_file(s3_buckets, path, key)
+
+    def upload_files(self, s3_bucket, uploads, entry_points=None):
+        """Upload largest files first, then entry points once all assets succeed
+
+        Each upload is a (key, file) pair. A file with "Buckets" is sent to
+        each of those buckets instead of s3_bucket. When an upload fails the
+        keys that were not uploaded are left in failed_uploads."""
+        assets = [f for f in uploads if not self.is_entry_point(f[0], entry_points)]
+        pages = [f for f in uploads if self.is_entry_point(f[0], entry_points)]
+
+        self.failed_uploads = []
+        for phase in (assets, pages):
+            phase.sort(key=lambda f: f[1]["Size"], reverse=True)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self.upload_to, f[1].get("Buckets") or [s3_bucket],
+                                           f[1]["Path"], f[0])
+                           for f in phase]
+            errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                self.failed_uploads = [f[0] for f, future in zip(phase, futures) if future.exception()]
+                if phase is assets:
+                    self.failed_uploads.extend(f[0] for f in pages)
+                console.message("\t🚨    {0} uploads failed, entry points were not updated\n".format(
+                    len(errors)), event="upload_failed", count=len(errors), error=str(errors[0]))
+                raise errors[0]
+        return
+
+    def sync_path(self, pathname, bucket_names, delete, entry_points=None, abort_stale=False):
+        """Synchronize Local Path to one or more S3 Buckets"""
+        if isinstance(bucket_names, str):
+            bucket_names = [bucket_names]
+        console.message("\t" + ("📄    "*21)+"\n")
         msg = "Will Syncronize Local Folder to S3 Bucket"
-        print("\t📄" + (" " * (floor((99-len(msg))/2))) +
-              msg + (" " * (ceil((99-len(msg))/2))) + "📄\n")
+        console.message("\t📄" + (" " * (floor((99-len(msg))/2))) +
+                        msg + (" " * (ceil((99-len(msg))/2))) + "📄\n")
 
         path = Path(pathname).expanduser().resolve()
         msg = str(path)
-        print("\t📄" + (" " * (floor((99-len(msg))/2))) +
-              msg + (" " * (ceil((99-len(msg))/2))) + "📄\n")
-        s3_bucket = self.init_bucket(bucket_name)
-        msg = s3_bucket.name
-        print("\t📄" + (" " * (floor((99-len(msg))/2))) +
-              msg + (" " * (ceil((99-len(msg))/2))) + "📄\n")
-        self.load_manifest(s3_bucket)
-        self.get_local_path(path, path, s3_bucket)
+        console.message("\t📄" + (" " * (floor((99-len(msg))/2))) +
+                        msg + (" " * (ceil((99-len(msg))/2))) + "📄\n")
+        s3_buckets = [self.init_bucket(name) for name in bucket_names]
+        for s3_bucket in s3_buckets:
+            msg = s3_bucket.name
+            console.message("\t📄" + (" " * (floor((99-len(msg))/2))) +
+                            msg + (" " * (ceil((99-len(msg))/2))) + "📄\n",
+                            event="sync", path=str(path), bucket=s3_bucket.name)
+        with run_stats.phase('list'):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                manifests = list(executor.map(self.fetch_manifest, s3_buckets))
+            self.manifests = {b.name: m for b, m in zip(s3_buckets, manifests)}
+            self.manifest.update(manifests[0])
+        with run_stats.phase('hash'):
+            self.get_local_path(path, path, s3_buckets[0])
+        if abort_stale:
+            with run_stats.phase('list'):
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    list(executor.map(self.abort_stale_uploads, s3_buckets))
 
+        uploads = []
         for f in self.local_manifest.items():
-            do_upload = False
-            if f[0] in self.manifest:
-                if self.manifest[f[0]] != f[1]["ETag"]:
+            targets = []
+            for s3_bucket in s3_buckets:
+                manifest = self.manifests[s3_bucket.name]
+                do_upload = False
+                if f[0] in manifest:
+                    if manifest[f[0]] != f[1]["ETag"]:
+                        do_upload = True
+                else:
                     do_upload = True
-            else:
-                do_upload = True
 
-            if do_upload:
-                self.upload_file(s3_bucket, f[1]["Path"], f[0])
+                if do_upload:
+                    targets.append(s3_bucket)
+            if targets:
+                uploads.append((f[0], dict(f[1], Buckets=targets)))
+        stale = {b.name: [k for k in self.manifests[b.name] if k not in self.local_manifest]
+                 if delete else [] for b in s3_buckets}
+        console.start("sync", len(uploads) + sum(len(keys) for keys in stale.values()))
+        with run_stats.phase('upload'):
+            self.upload_files(None, uploads, entry_points)
+        if delete:
+            for s3_bucket in s3_buckets:
+                del_obj = []
+                for key in stale[s3_bucket.name]:
+                    # print("\tWe will delete {0}".format(key))
+                    del_obj.append({"Key": key})
+
+                if del_obj:
+                    self.delete_manifest = {"Objects": del_obj}
+                    with run_stats.phase('delete'):
+                        self.delete_keys(s3_bucket, [o["Key"] for o in del_obj])
+                    for o in del_obj:
+                        console.item("delete", o["Key"], "\t📄    ❌    " + o["Key"] +
+                                     (" " * (90 - len(o["Key"]))) + "📄\n", bucket=s3_bucket.name)
+
+        console.finish()
+        console.message("\t" + ("📄    "*21))
+        return
+
+    def promote(self, src_name, dst_name, delete):
+        """Copy changed objects from one bucket to another without downloading them"""
+        console.message("\t" + ("📄    "*21)+"\n")
+        msg = "Will Promote {0} to {1}".format(src_name, dst_name)
+        console.message("\t📄" + (" " * (floor((99-len(msg))/2))) +
+                        msg + (" " * (ceil((99-len(msg))/2))) + "📄\n",
+                        event="promote", source=src_name, bucket=dst_name)
+        src_bucket = self.get_bucket(src_name)
+        dst_bucket = self.init_bucket(dst_name)
+        with run_stats.phase('list'):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                src_objects, dst_manifest = executor.map(
+                    lambda f: f[0](f[1]),
+                    [(self.fetch_objects, src_bucket), (self.fetch_manifest, dst_bucket)])
+
+        copies = [(k, obj) for k, obj in src_objects.items()
+                  if dst_manifest.get(k) != obj['ETag']]
+        copies.sort(key=lambda c: c[1]['Size'], reverse=True)
+        stale = [k for k in dst_manifest if k not in src_objects] if delete else []
+        console.start("promote", len(copies) + len(stale))
+        with run_stats.phase('copy'):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(self.copy_object, src_name, dst_name, key, obj)
+                               for key, obj in copies]:
+                    future.result()
+        if stale:
+            with run_stats.phase('delete'):
+                self.delete_keys(dst_bucket, stale)
+            for key in stale:
+                console.item("delete", key, "\t📄    ❌    " + key +
+                             (" " * (90 - len(key))) + "📄\n", bucket=dst_name)
+        console.finish()
+        console.message("\t" + ("📄    "*21))
+        return
+
+    def copy_object(self, src_name, dst_name, key, obj):
+        """Server side copy of one object, multipart for multipart sources and objects over 5 GiB"""
+        client = self.client_for(dst_name)
+        source = {'Bucket': src_name, 'Key': key}
+        part_size = self.object_part_size(src_name, key, obj)
+        if not part_size and obj['Size'] <= self.COPY_LIMIT:
+            self.controller.call(client.copy_object, key=key, Bucket=dst_name, Key=key,
+                                 CopySource=source, MetadataDirective='COPY')
+            run_stats.add('bytes_copied', obj['Size'])
+            self.report_copy(dst_name, key, obj)
+            return
+
+        part_size = part_size or self.CHUNK_SIZE
+        head = client.head_object(**source)
+        extra = {k: head[k] for k in self.COPY_HEADERS if k in head}
+        upload_id = client.create_multipart_upload(
+            Bucket=dst_name, Key=key, Metadata=head.get('Metadata', {}), **extra)['UploadId']
+
+        def copy_part(part_number):
+            start = (part_number - 1) * part_size
+            end = min(start + part_size, obj['Size']) - 1
+            response = self.controller.call(
+                client.upload_part_copy, key=key, Bucket=dst_name, Key=key,
+                UploadId=upload_id, PartNumber=part_number, CopySource=source,
+                CopySourceRange="bytes={0}-{1}".format(start, end))
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.clients.TRANSFER_CONCURRENCY) as executor:
+                parts = list(executor.map(copy_part, range(1, ceil(obj['Size'] / part_size) + 1)))
+            client.complete_multipart_upload(Bucket=dst_name, Key=key, UploadId=upload_id,
+                                             MultipartUpload={'Parts': parts})
+        except Exception:
+            client.abort_multipart_upload(Bucket=dst_name, Key=key, UploadId=upload_id)
+            raise
+        run_stats.add('bytes_copied', obj['Size'])
+        self.report_copy(dst_name, key, obj)
+        return
+
+    def report_copy(self, dst_name, key, obj):
+        console.item("copy", key, "\t📄    🔁    " + key + (" " * (90 - len(key))) + "📄\n",
+                     size=obj['Size'], bucket=dst_name)
+
+    def pull(self, bucket_name, pathname, delete):
+        """Download objects that differ from the local copy"""
+        console.message("\t" + ("📄    "*21)+"\n")
+        path = Path(pathname).expanduser().resolve()
+        msg = "Will Download {0} to {1}".format(bucket_name, path)
+        console.message("\t📄" + (" " * (floor((99-len(msg))/2))) +
+                        msg + (" " * (ceil((99-len(msg))/2))) + "📄\n",
+                        event="pull", path=str(path), bucket=bucket_name)
+        path.mkdir(parents=True, exist_ok=True)
+        s3_bucket = self.get_bucket(bucket_name)
+        with run_stats.phase('list'):
+            objects = {k: obj for k, obj in self.fetch_objects(s3_bucket).items()
+                       if not k.endswith('/')}
+
+        downloads = []
+        with run_stats.phase('hash'):
+            for key, obj in objects.items():
+                target = (path / key).resolve()
+                if path not in target.parents:
+                    continue
+                if target.is_file() and target.stat().st_size == obj['Size'] and \
+                        self.local_etag(target, obj['ETag'],
+                                        self.object_part_size(bucket_name, key, obj)) == obj['ETag']:
+                    continue
+                downloads.append((key, obj, target))
+        downloads.sort(key=lambda d: d[1]['Size'], reverse=True)
+
+        stale = []
         if delete:
-            del_obj = []
-            for f in self.manifest.items():
-                if f[0] not in self.local_manifest:
-                    print("\t📄    ❌    " + f[0] +
-                          (" " * (90 - len(f[0]))) + "📄\n")
-                    # print("\tWe will delete {0}".format(f[0]))
-                    del_obj.append({"Key": f[0]})
-
-            if del_obj:
-                self.delete_manifest = {"Objects": del_obj}
-                s3_bucket.delete_objects(Delete=self.delete_manifest)
-
-        print("\t" + ("📄    "*21))
+            stale = [p for p in path.rglob('*')
+                     if p.is_file() and p.relative_to(path).as_posix() not in objects]
+        console.start("pull", len(downloads) + len(stale))
+        with run_stats.phase('download'):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(self.download_file, bucket_name, key, obj, target)
+                               for key, obj, target in downloads]:
+                    future.result()
+        for p in stale:
+            key = p.relative_to(path).as_posix()
+            p.unlink()
+            console.item("delete", key, "\t📄    ❌    " + key + (" " * (90 - len(key))) + "📄\n",
+                         path=str(p))
+        console.finish()
+        console.message("\t" + ("📄    "*21))
         return
 
+    def download_file(self, bucket_name, key, obj, target):
+        """Download an object with concurrent ranged GETs into a preallocated file"""
+        client = self.client_for(bucket_name)
+        part_size = self.object_part_size(bucket_name, key, obj)
+        range_size = part_size or self.CHUNK_SIZE
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + '.webotron')
+
+        encrypted = []
+        fd = os.open(str(partial), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, obj['Size'])
+
+            def fetch(start):
+                end = min(start + range_size, obj['Size']) - 1
+                response = self.controller.call(
+                    client.get_object, key=key, Bucket=bucket_name, Key=key,
+                    Range="bytes={0}-{1}".format(start, end), IfMatch='"{0}"'.format(obj['ETag']))
+                if response.get('ServerSideEncryption', '').startswith('aws:kms') or \
+                        'SSECustomerAlgorithm' in response:
+                    encrypted.append(start)
+                offset = start
+                for chunk in response['Body'].iter_chunks(1048576):
+                    offset += os.pwrite(fd, chunk, offset)
+                return offset - start
+
+            if obj['Size']:
+                with ThreadPoolExecutor(max_workers=self.clients.TRANSFER_CONCURRENCY) as executor:
+                    received = sum(executor.map(fetch, range(0, obj['Size'], range_size)))
+                run_stats.add('bytes_downloaded', received)
+        finally:
+            os.close(fd)
+
+        # ETags of SSE-KMS and SSE-C objects are not MD5s of the content
+        etag = None if encrypted else self.local_etag(partial, obj['ETag'], part_size)
+        if etag is None:
+            run_stats.add('downloads_unverified')
+        elif etag != obj['ETag']:
+            partial.unlink()
+            raise IOError("Download of {0} failed verification: ETag {1} != {2}".format(
+                key, etag, obj['ETag']))
+        os.replace(str(partial), str(target))
+        console.item("download", key, "\t📄    ⬇️    " + key + (" " * (90 - len(key))) + "📄\n",
+                     size=obj['Size'], bucket=bucket_name)
+        return
+
+    def watch_path(self, pathname, bucket_name, delete, entry_points=None,
+                   debounce=0.2, poll_interval=1.0, force_polling=False):
+        """Sync once, then upload or delete only the files that change"""
+        from webotron.watch import get_watcher
+
+        path = Path(pathname).expanduser().resolve()
+        watcher = get_watcher(path, poll_interval, force_polling)
+        self.sync_path(pathname, bucket_name, delete, entry_points)
+        s3_bucket = self.get_bucket(bucket_name)
+        for key, f in self.local_manifest.items():
+            self.manifest[key] = f["ETag"]
+        if delete:
+            for key in [k for k in self.manifest if k not in self.local_manifest]:
+                del self.manifest[key]
+
+        console.message("\t👀    Watching {0} for changes\n".format(path),
+                        event="watch", path=str(path), bucket=bucket_name)
+        failed = set()
+        try:
+            while True:
+                changed = watcher.wait()
+                while True:
+                    more = watcher.wait(debounce)
+                    if not more:
+                        break
+                    changed |= more
+                if getattr(watcher, 'overflowed', False):
+                    watcher.overflowed = False
+                    changed = {p for p in path.rglob('*') if p.is_file()} \
+                        | {path / k for k in self.manifest}
+                # Paths that failed in earlier batches are retried with this one
+                changed |= failed
+                try:
+                    failed = self.sync_changes(path, s3_bucket, changed, delete, entry_points)
+                except Exception as e:
+                    failed = changed
+                    console.message("\t🚨    Sync of {0} changes failed, will retry: {1}\n".format(
+                        len(changed), e), event="batch_failed", count=len(changed), error=str(e))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        return
+
+    def sync_changes(self, root, s3_bucket, paths, delete, entry_points=None):
+        """Upload or delete the given paths, keeping the in-memory manifest current
+
+        Returns the paths that could not be synced so they can be retried."""
+        start = time.monotonic()
+        uploads = []
+        removed = []
+        failed = set()
+        for p in paths:
+            try:
+                key = p.relative_to(root).as_posix()
+            except ValueError:
+                continue
+            try:
+                if p.is_file():
+                    etag = self.calculate_etag(p)
+                    if self.manifest.get(key) != etag:
+                        uploads.append((key, {"Path": str(p), "ETag": etag,
+                                              "Size": p.stat().st_size}))
+                    continue
+            except OSError as e:
+                # Deleted or replaced while it was hashed, the next event
+                # for it tells us which
+                if p.exists():
+                    failed.add(p)
+                    console.message("\t🚨    Cannot read {0}, will retry: {1}\n".format(key, e),
+                                    event="read_failed", key=key, error=str(e))
+                    continue
+            if not p.exists():
+                prefix = key + '/'
+                removed.extend(k for k in self.manifest
+                               if k == key or k.startswith(prefix))
+
+        if not uploads and not (delete and removed):
+            return failed
+        console.start("sync", len(uploads) + (len(removed) if delete else 0))
+        try:
+            with run_stats.phase('upload'):
+                self.upload_files(s3_bucket, uploads, entry_points)
+        except Exception:
+            not_uploaded = set(self.failed_uploads) or {key for key, f in uploads}
+            failed.update(root / key for key in not_uploaded)
+            uploads = [u for u in uploads if u[0] not in not_uploaded]
+        for key, f in uploads:
+            self.manifest[key] = f["ETag"]
+        if delete and removed:
+            try:
+                with run_stats.phase('delete'):
+                    self.delete_keys(s3_bucket, removed)
+            except Exception as e:
+                failed.update(root / key for key in removed)
+                console.message("\t🚨    {0} deletes failed, will retry: {1}\n".format(len(removed), e),
+                                event="delete_failed", count=len(removed), error=str(e))
+                removed = []
+            for key in removed:
+                console.item("delete", key, "\t📄    ❌    " + key +
+                             (" " * (90 - len(key))) + "📄\n", bucket=s3_bucket.name)
+            for key in removed:
+                self.manifest.pop(key, None)
+        console.finish()
+        console.message("\t👀    {0} uploaded, {1} deleted, {2} failed in {3:.2f}s\n".format(
+            len(uploads), len(removed) if delete else 0, len(failed), time.monotonic() - start),
+            event="batch", uploaded=len(uploads), deleted=len(removed) if delete else 0,
+            failed=len(failed))
+        return failed
+
     def delete_bucket(self, bucket_name, domain_manager, cdn_manager, pattern_match=False):
         """Empties Bucket and Deletes It"""
         buckets = []
 
         buckets = self.find_bucket(bucket_name, pattern_match)
+        buckets = [self.get_bucket(b.name)
+                   for group in self.by_region(buckets).values() for b in group]
         if not buckets:
             msg = "No Buckets found to delete"
             msg = ("\t🚨    🚨    🚨" + (" " * (floor((79-len(msg))/2))) +
                    msg + (" " * (ceil((79-len(msg))/2))) + "🚨    🚨    🚨\n")
-            print(msg)
+            console.message(msg)
 
         for b in buckets:
             if b.name in util.protected_buckets:
-                print("\t" + ("💀    "*21)+"\n")
+                console.message("\t" + ("💀    "*21)+"\n")
                 msg = "Will not delete protected bucket {0}".format(b.name)
                 msg = ("\t💀    💀    💀" + (" " * (floor((79-len(msg))/2))) +
                     msg + (" " * (ceil((79-len(msg))/2))) + "💀    💀    💀\n")
-                print(msg)
-                print("\t" + ("💀    "*21)+"\n")
+                console.message(msg)
+                console.message("\t" + ("💀    "*21)+"\n")
             else:
                 hasObj = bool(len(list(b.objects.all().limit(1))))
                 if hasObj:
                     msg = "We will empty all objects from bucket {0}".format(b.name)
                     msg = ("\t🚨    " + msg + (" " * (95-len(msg))) + "🚨\n")
-                    print(msg)
-                    for o in b.objects.all():
-                        if o.key:
-                            msg = "We will delete {0}".format(o.key)
-                            msg=("\t🚨\t    " + msg + (" " * (88-len(msg))) + "🚨\n")
-                            print(msg)
-                            b.delete_objects(
-                                Delete={'Objects': [{'Key':  o.key}], 'Quiet': True})
+                    console.message(msg)
+                    objects = [(o.key, o.size) for o in b.objects.all() if o.key]
+                    console.start("delete", len(objects))
+                    with run_stats.phase('delete'):
+                        self.delete_keys(b, [key for key, _ in objects])
+                    for key, size in objects:
+                        msg = "Deleted {0}".format(key)
+                        msg=("\t🚨\t    " + msg + (" " * (88-len(msg))) + "🚨\n")
+                        console.item("delete", key, msg, size=size, bucket=b.name)
+                    console.finish()
                 
                 msg = "We will delete bucket {0}".format(b.name)
                 msg = ("\t🚨    " + msg + (" " * (95-len(msg))) + "🚨\n")
-                print(msg)
+                console.message(msg, event="delete_bucket", bucket=b.name)
                 ws = b.Website()
                 try:
                     ws.load()
@@ -276,13 +1071,14 @@ class BucketManager:
 
                     msg = "We need to delete CloudFront"
                     msg = ("\t🚨    " + msg + (" " * (95-len(msg))) + "🚨\n")
-                    print(msg)
+                    console.message(msg)
 
-                    cdn_manager.disable_distribution(b.name)
+                    with run_stats.phase('cloudfront'):
+                        cdn_manager.disable_distribution(b.name)
 
                     msg = "We need to delete the DNS"
                     msg = ("\t🚨    " + msg + (" " * (95-len(msg))) + "🚨\n")
-                    print(msg)
+                    console.message(msg)
 
 
                     response = domain_manager.delete_s3_domain_record(
@@ -290,7 +1086,7 @@ class BucketManager:
                     if response == 200:
                         msg = "DNS deleted sucessfully"
                         msg = ("\t🚨\t    " + msg + (" " * (88-len(msg))) + "🚨\n")
-                        print(msg)
+                        console.message(msg)
 
                 except ClientError as e:
                     if e.response['Error']['Code'] == "NoSuchWebsiteConfiguration":
@@ -299,3 +1095,4 @@ class BucketManager:
                         raise e
 
                 b.delete()
+                self.regions.remove(b.name)
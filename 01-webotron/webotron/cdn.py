@@ -1,24 +1,25 @@
 # -*- code utf-8 -*-
 
 """Classes for CloudFront"""
-import boto3
-from botocore.exceptions import ClientError
-from pprint import pprint
 from math import floor
 from math import ceil
 import uuid
-from webotron.cert import CertManager
-from webotron.bucket import BucketManager
-from webotron.domain import DomainManager
+
+from webotron.stats import run_stats
 
 
 class CloudFrontManager:
     """Manage CloudFront"""
 
-    def __init__(self, session):
+    def __init__(self, clients):
         """Creates a CertManager object"""
-        self.session = session
-        self.client = self.session.client('cloudfront')
+        self.clients = clients
+        self.session = clients.session
+
+    @property
+    def client(self):
+        """CloudFront client, shared through the client factory"""
+        return self.clients.client('cloudfront')
 
     def lookup_distribution(self, website):
         """Find a CloudFront Distribution that Matches Domain Name"""
@@ -101,13 +102,14 @@ class CloudFrontManager:
                   response['Distribution']['DomainName']+"\n")
             print("\t⛅️    Waiting for CloudFront to Deploy\n")
             waiter = self.client.get_waiter('distribution_deployed')
-            waiter.wait(
-                Id=response['Distribution']['Id'],
-                WaiterConfig={
-                    'Delay': 60,
-                    'MaxAttempts': 60
-                }
-            )
+            with run_stats.phase('cloudfront_wait'):
+                waiter.wait(
+                    Id=response['Distribution']['Id'],
+                    WaiterConfig={
+                        'Delay': 60,
+                        'MaxAttempts': 60
+                    }
+                )
             print("\t⛅️    CloudFront Deployed\n")
             print("\t" + ("⛅️    " * 21)+"\n")
             return(response['Distribution'])
@@ -145,13 +147,14 @@ class CloudFrontManager:
                 )
 
                 waiter = self.client.get_waiter('distribution_deployed')
-                waiter.wait(
-                    Id=dist['Id'],
-                    WaiterConfig={
-                        'Delay': 60,
-                        'MaxAttempts': 60
-                    }
-            )
+                with run_stats.phase('cloudfront_wait'):
+                    waiter.wait(
+                        Id=dist['Id'],
+                        WaiterConfig={
+                            'Delay': 60,
+                            'MaxAttempts': 60
+                        }
+                    )
       
             else:
                 msg = "CloudFront Distribution Not Enabled"
@@ -1,18 +1,20 @@
 # -*- code utf-8 -*-
 
 """Classes for AWS Certificate Manager"""
-import boto3
-from botocore.exceptions import ClientError
-from pprint import pprint
 
 
 class CertManager:
     """Manage an AWS Certificate"""
 
-    def __init__(self, session):
+    def __init__(self, clients):
         """Creates a CertManager object"""
-        self.session = session
-        self.client = self.session.client('acm', region_name='us-east-1')
+        self.clients = clients
+        self.session = clients.session
+
+    @property
+    def client(self):
+        """ACM client, shared through the client factory"""
+        return self.clients.client('acm', region_name='us-east-1')
 
     def get_certificate(self, website):
         """Find a Hosted Zone that Matches Domain Name"""
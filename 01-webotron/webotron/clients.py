@@ -0,0 +1,109 @@
+# -*- code utf-8 -*-
+
+"""Shared AWS Clients for Webotron"""
+import threading
+
+from webotron.stats import run_stats
+from webotron.throttle import skip_throttle_retry
+
+
+SESSION_KEYS = ('profile_name', 'region_name',
+                'aws_access_key_id', 'aws_secret_access_key', 'aws_session_token')
+
+settings = {
+    'workers': 8,
+    'connect_timeout': 10,
+    'read_timeout': 60,
+    'tcp_keepalive': False,
+}
+
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """Update client settings, takes effect for clients created afterwards"""
+    global _factory
+    changes = {k: v for k, v in kwargs.items()
+               if v is not None and settings.get(k) != v}
+    if changes:
+        settings.update(changes)
+        with _factory_lock:
+            _factory = None
+
+
+def get_factory():
+    """Returns the shared ClientFactory, created on first use"""
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            import boto3
+            session = boto3.Session(
+                **{k: settings[k] for k in SESSION_KEYS if k in settings})
+            _factory = ClientFactory(
+                session,
+                workers=settings['workers'],
+                connect_timeout=settings['connect_timeout'],
+                read_timeout=settings['read_timeout'],
+                tcp_keepalive=settings['tcp_keepalive'])
+        return _factory
+
+
+class ClientFactory:
+    """Create boto3 clients once and share them across managers and threads"""
+
+    TRANSFER_CONCURRENCY = 10
+
+    def __init__(self, session, workers=8, connect_timeout=10, read_timeout=60, tcp_keepalive=False):
+        """Creates a ClientFactory object"""
+        self.session = session
+        self.workers = workers
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tcp_keepalive = tcp_keepalive
+        self._clients = {}
+        self._resources = {}
+        self._lock = threading.Lock()
+        run_stats.install(session)
+
+    @property
+    def max_pool_connections(self):
+        """Connections needed for every worker to run a full transfer"""
+        return max(10, self.workers * self.TRANSFER_CONCURRENCY)
+
+    def config(self):
+        """botocore Config shared by every client"""
+        from botocore.config import Config
+        return Config(
+            max_pool_connections=self.max_pool_connections,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            tcp_keepalive=self.tcp_keepalive)
+
+    def client(self, service, region_name=None):
+        """Returns the shared client for a service and region"""
+        with self._lock:
+            return self._client(service, region_name)
+
+    def _client(self, service, region_name):
+        key = (service, region_name)
+        if key not in self._clients:
+            client = self.session.client(
+                service, region_name=region_name, config=self.config())
+            if service == 's3':
+                # Requests made through the ConcurrencyController need it to
+                # see throttling on the first SlowDown, others keep retrying
+                client.meta.events.register_first('needs-retry.s3', skip_throttle_retry)
+            self._clients[key] = client
+        return self._clients[key]
+
+    def resource(self, service, region_name=None):
+        """Returns a resource for a service backed by the shared client"""
+        with self._lock:
+            key = (service, region_name)
+            if key not in self._resources:
+                resource = self.session.resource(
+                    service, region_name=region_name, config=self.config())
+                resource.meta.client = self._client(service, region_name)
+                self._resources[key] = resource
+            return self._resources[key]
@@ -1,18 +1,20 @@
 # -*- code utf-8 -*-
 
 import uuid
-from webotron import util
-import webotron.bucket
 """Classes for Route 53 Domains"""
 
 class DomainManager:
     """Manage a Route 53 Domain"""
 
-    def __init__(self,session):
+    def __init__(self, clients):
         """Create a DomainManager Object"""
-    
-        self.session = session
-        self.client = self.session.client('route53')
+        self.clients = clients
+        self.session = clients.session
+
+    @property
+    def client(self):
+        """Route 53 client, shared through the client factory"""
+        return self.clients.client('route53')
 
     def get_hosted_zone(self,domain_name):
         """Find a Hosted Zone that Matches Domain Name"""
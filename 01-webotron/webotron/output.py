@@ -0,0 +1,111 @@
+# -*- code utf-8 -*-
+
+"""Output Modes for Per-Object Progress"""
+import json
+import sys
+import threading
+import time
+
+
+class Output:
+    """Render per-object events as fancy lines, a progress bar, JSON lines or nothing"""
+
+    MODES = ('fancy', 'progress', 'jsonl', 'quiet')
+    BAR_WIDTH = 40
+
+    def __init__(self, mode='fancy', stream=None, refresh=0.25, buffer_lines=1000):
+        """Creates an Output object"""
+        self.mode = mode
+        self.stream = stream
+        self.refresh = refresh
+        self.buffer_lines = buffer_lines
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._reset()
+
+    def _reset(self):
+        self.total = None
+        self.label = ''
+        self.done = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._drawn = 0
+
+    def configure(self, mode):
+        """Switch output mode"""
+        self.mode = mode
+
+    @property
+    def out(self):
+        return self.stream or sys.stdout
+
+    def message(self, fancy, event=None, **fields):
+        """A status line, shown in fancy mode and emitted as an event in jsonl mode"""
+        if self.mode == 'fancy':
+            self._print(fancy)
+        elif self.mode == 'jsonl' and event:
+            self._emit(dict(fields, event=event))
+
+    def start(self, label, total=None):
+        """Begin counting items for the progress bar"""
+        with self._lock:
+            self._reset()
+            self.label = label
+            self.total = total
+
+    def item(self, event, key, fancy, size=0, **fields):
+        """Report one object, safe to call from worker threads"""
+        if self.mode == 'fancy':
+            self._print(fancy)
+        elif self.mode == 'jsonl':
+            self._emit(dict(fields, event=event, key=key, size=size))
+        elif self.mode == 'progress':
+            with self._lock:
+                self.done += 1
+                self.bytes += size
+                now = time.monotonic()
+                if now - self._drawn >= self.refresh:
+                    self._drawn = now
+                    self._draw()
+
+    def finish(self):
+        """Flush buffered output and end the progress bar"""
+        with self._lock:
+            if self.mode == 'progress' and (self.done or self.total):
+                self._draw()
+                self.out.write("\n")
+                self.out.flush()
+            elif self.mode == 'jsonl':
+                self._flush()
+            self._reset()
+
+    def _print(self, line):
+        with self._lock:
+            self.out.write(line + "\n")
+
+    def _draw(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        if self.total:
+            filled = int(self.BAR_WIDTH * min(self.done, self.total) / self.total)
+            bar = "[{0}{1}] {2}/{3}".format(
+                "#" * filled, "." * (self.BAR_WIDTH - filled), self.done, self.total)
+        else:
+            bar = "{0}".format(self.done)
+        self.out.write("\r{0} {1} {2:.1f} MB {3:.1f}/s".format(
+            self.label, bar, self.bytes / 1048576, self.done / elapsed))
+        self.out.flush()
+
+    def _emit(self, record):
+        with self._lock:
+            self._buffer.append(json.dumps(record, default=str))
+            if len(self._buffer) >= self.buffer_lines:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.out.write("\n".join(self._buffer) + "\n")
+            self.out.flush()
+            self._buffer = []
+
+
+console = Output()
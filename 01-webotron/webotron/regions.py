@@ -0,0 +1,62 @@
+# -*- code utf-8 -*-
+
+"""Bucket Region Cache"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class RegionCache:
+    """Bucket to region map saved to a local JSON file, entries expire after ttl seconds"""
+
+    DEFAULT_PATH = '~/.webotron/regions.json'
+    DEFAULT_TTL = 86400
+
+    def __init__(self, path=None, ttl=None):
+        """Creates a RegionCache object"""
+        self.path = Path(path or self.DEFAULT_PATH).expanduser()
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.regions = json.load(f)
+        except (OSError, ValueError):
+            self.regions = {}
+
+    def get(self, bucket):
+        """Cached region for a bucket, or None when unknown or expired"""
+        with self._lock:
+            entry = self.regions.get(bucket)
+        if entry and time.time() - entry['Checked'] < self.ttl:
+            return entry['Region']
+        return None
+
+    def put(self, bucket, region, save=True):
+        """Remember the region of a bucket"""
+        with self._lock:
+            self.regions[bucket] = {'Region': region, 'Checked': time.time()}
+            if save:
+                self._save()
+
+    def remove(self, bucket):
+        """Forget a bucket"""
+        with self._lock:
+            if self.regions.pop(bucket, None):
+                self._save()
+
+    def save(self):
+        """Write the cache to disk"""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.regions, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
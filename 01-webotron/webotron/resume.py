@@ -0,0 +1,185 @@
+# -*- code utf-8 -*-
+
+"""Resumable Multipart Uploads"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+
+class UploadState:
+    """Multipart upload progress saved to a local JSON file"""
+
+    DEFAULT_PATH = '~/.webotron/uploads.json'
+
+    def __init__(self, path=None):
+        """Creates an UploadState object"""
+        self.path = Path(path or self.DEFAULT_PATH).expanduser()
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.uploads = json.load(f)
+        except (OSError, ValueError):
+            self.uploads = {}
+
+    @staticmethod
+    def name(bucket, key):
+        """State key for an object"""
+        return "{0}/{1}".format(bucket, key)
+
+    def get(self, bucket, key):
+        """Saved upload for an object, or None"""
+        with self._lock:
+            return self.uploads.get(self.name(bucket, key))
+
+    def upload_ids(self, bucket):
+        """Upload IDs being tracked for a bucket"""
+        with self._lock:
+            return {u['UploadId'] for u in self.uploads.values()
+                    if u['Bucket'] == bucket}
+
+    def put(self, upload):
+        """Save an upload"""
+        with self._lock:
+            self.uploads[self.name(upload['Bucket'], upload['Key'])] = upload
+            self._save()
+
+    def add_part(self, upload, part_number, etag):
+        """Record a completed part"""
+        with self._lock:
+            upload['Parts'][str(part_number)] = etag
+            self._save()
+
+    def remove(self, bucket, key):
+        """Forget an upload"""
+        with self._lock:
+            self.uploads.pop(self.name(bucket, key), None)
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.uploads, f)
+        os.replace(tmp, self.path)
+
+
+class ResumableUploader:
+    """Upload large files in parts that survive a process restart"""
+
+    MAX_PARTS = 10000
+    STALE_AGE = 86400
+
+    def __init__(self, client, state, part_size, concurrency=4):
+        """Creates a ResumableUploader object"""
+        self.client = client
+        self.state = state
+        self.part_size = part_size
+        self.concurrency = concurrency
+
+    def can_upload(self, size):
+        """True if a file fits within the multipart part limit"""
+        return size <= self.part_size * self.MAX_PARTS
+
+    def upload(self, path, bucket, key, extra_args=None, callback=None):
+        """Upload path to bucket/key, resuming a saved upload if possible"""
+        stat = os.stat(path)
+        upload = self._resume(bucket, key, stat)
+        if not upload:
+            response = self.client.create_multipart_upload(
+                Bucket=bucket, Key=key, **(extra_args or {}))
+            upload = {
+                'Bucket': bucket, 'Key': key, 'UploadId': response['UploadId'],
+                'Size': stat.st_size, 'MTime': stat.st_mtime,
+                'PartSize': self.part_size, 'Parts': {}}
+            self.state.put(upload)
+
+        part_count = max(1, -(-stat.st_size // self.part_size))
+        missing = [n for n in range(1, part_count + 1)
+                   if str(n) not in upload['Parts']]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(self._upload_part, path, upload, n, callback)
+                           for n in missing]:
+                future.result()
+
+        self.client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload['UploadId'],
+            MultipartUpload={'Parts': [
+                {'PartNumber': n, 'ETag': upload['Parts'][str(n)]}
+                for n in range(1, part_count + 1)]})
+        self.state.remove(bucket, key)
+        return
+
+    def _upload_part(self, path, upload, part_number, callback):
+        with open(path, 'rb') as f:
+            f.seek((part_number - 1) * self.part_size)
+            data = f.read(self.part_size)
+        response = self.client.upload_part(
+            Bucket=upload['Bucket'], Key=upload['Key'], UploadId=upload['UploadId'],
+            PartNumber=part_number, Body=data)
+        self.state.add_part(upload, part_number, response['ETag'])
+        if callback:
+            callback(len(data))
+
+    def _resume(self, bucket, key, stat):
+        """Saved upload for an unchanged file with parts confirmed by ListParts"""
+        upload = self.state.get(bucket, key)
+        if not upload:
+            return None
+        if upload['Size'] != stat.st_size or upload['MTime'] != stat.st_mtime \
+                or upload['PartSize'] != self.part_size:
+            self.abort(bucket, key, upload['UploadId'])
+            return None
+
+        parts = {}
+        try:
+            paginator = self.client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload['UploadId']):
+                for part in page.get('Parts', []):
+                    parts[str(part['PartNumber'])] = part['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchUpload':
+                self.state.remove(bucket, key)
+                return None
+            raise e
+        upload['Parts'] = parts
+        self.state.put(upload)
+        return upload
+
+    def abort(self, bucket, key, upload_id):
+        """Abort an upload and forget it"""
+        try:
+            self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise e
+        self.state.remove(bucket, key)
+
+    def abort_stale(self, bucket, keys):
+        """Abort untracked uploads of keys older than STALE_AGE, returns their keys
+
+        Only uploads of the given keys are considered, uploads of other keys
+        may belong to other hosts or tools. Raises ClientError when uploads
+        cannot be listed."""
+        keys = set(keys)
+        tracked = self.state.upload_ids(bucket)
+        now = time.time()
+        aborted = []
+        paginator = self.client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=bucket):
+            for upload in page.get('Uploads', []):
+                initiated = upload['Initiated']
+                if upload['Key'] not in keys or not isinstance(initiated, datetime):
+                    continue
+                age = now - initiated.replace(tzinfo=initiated.tzinfo or timezone.utc).timestamp()
+                if upload['UploadId'] not in tracked and age > self.STALE_AGE:
+                    self.client.abort_multipart_upload(
+                        Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+                    aborted.append(upload['Key'])
+        return aborted
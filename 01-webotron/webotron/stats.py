@@ -0,0 +1,116 @@
+# -*- code utf-8 -*-
+
+"""Timing and API Call Metrics for a Webotron Run"""
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Stats:
+    """Wall time per phase, API calls per operation and transfer totals"""
+
+    def __init__(self):
+        """Creates a Stats object"""
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.api_calls = Counter()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        """Count API calls, retries and throttles made through a boto3 session"""
+        session.events.register('after-call', self._after_call)
+        session.events.register('after-call-error', self._after_call_error)
+        session.events.register('needs-retry', self._needs_retry)
+
+    def _after_call(self, model, parsed, **kwargs):
+        name = "{0}.{1}".format(model.service_model.service_name, model.name)
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        with self._lock:
+            self.api_calls[name] += 1
+            self.counters['retries'] += retries
+
+    def _after_call_error(self, context, exception, **kwargs):
+        with self._lock:
+            self.counters['failed_calls'] += 1
+
+    def _needs_retry(self, response=None, **kwargs):
+        # Imported here since throttle reports its backoffs through run_stats
+        from webotron.throttle import is_throttle_response
+        if response and is_throttle_response(response[1]):
+            with self._lock:
+                self.counters['throttled_responses'] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """Add the wall time of a block to a phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def add(self, name, amount=1):
+        """Increase a counter such as bytes_hashed or bytes_uploaded"""
+        with self._lock:
+            self.counters[name] += amount
+
+    def report(self):
+        """Stats as a dictionary"""
+        with self._lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self.started, 4),
+                'phases': {k: round(v, 4) for k, v in self.phases.items()},
+                'api_calls': dict(sorted(self.api_calls.items())),
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self):
+        """Stats in the Prometheus textfile collector format"""
+        report = self.report()
+        lines = [
+            '# TYPE webotron_run_seconds gauge',
+            'webotron_run_seconds {0}'.format(report['total_seconds']),
+            '# TYPE webotron_phase_seconds gauge',
+        ]
+        lines += ['webotron_phase_seconds{{phase="{0}"}} {1}'.format(k, v)
+                  for k, v in report['phases'].items()]
+        lines.append('# TYPE webotron_api_calls_total counter')
+        for name, count in report['api_calls'].items():
+            service, operation = name.split('.', 1)
+            lines.append('webotron_api_calls_total{{service="{0}",operation="{1}"}} {2}'.format(
+                service, operation, count))
+        for name, value in report['counters'].items():
+            lines.append('# TYPE webotron_{0}_total counter'.format(name))
+            lines.append('webotron_{0}_total {1}'.format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write a .prom textfile or a JSON report, chosen by extension"""
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if str(path).endswith('.prom') else self.to_json())
+
+    def print_summary(self):
+        """Print the stats in the webotron style"""
+        report = self.report()
+        print("\t" + ("📊    " * 21) + "\n")
+        print("\t📊    Total          : {0:.2f}s\n".format(report['total_seconds']))
+        for name, seconds in report['phases'].items():
+            print("\t📊    {0:<15}: {1:.2f}s\n".format(name, seconds))
+        for name, count in report['api_calls'].items():
+            print("\t📊    {0:<40}: {1}\n".format(name, count))
+        for name, value in report['counters'].items():
+            print("\t📊    {0:<20}: {1}\n".format(name, value))
+        print("\t" + ("📊    " * 21))
+
+
+run_stats = Stats()
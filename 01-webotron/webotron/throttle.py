@@ -0,0 +1,191 @@
+# -*- code utf-8 -*-
+
+"""Concurrency and Bandwidth Control for S3 Requests"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from webotron.stats import run_stats
+
+
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException',
+                  'RequestLimitExceeded', 'ServiceUnavailable', 'TooManyRequestsException')
+
+_local = threading.local()
+
+
+def is_throttle_response(response):
+    """True if a parsed error response is S3 asking us to slow down"""
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in THROTTLE_CODES or status == 503
+
+
+def error_response(error):
+    """Parsed response of the ClientError behind error, following wrapped causes"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, 'response', None)
+        if isinstance(response, dict):
+            return response
+        error = error.__cause__ or error.__context__
+    return None
+
+
+@contextmanager
+def controlled():
+    """Mark requests made on this thread as retried by the ConcurrencyController"""
+    outer = getattr(_local, 'controlled', False)
+    _local.controlled = True
+    try:
+        yield
+    finally:
+        _local.controlled = outer
+
+
+def skip_throttle_retry(response=None, **kwargs):
+    """needs-retry hook leaving throttling responses to the ConcurrencyController
+
+    botocore would otherwise retry SlowDown itself and the controller would
+    only hear about it once every retry was spent. Only requests made inside
+    ConcurrencyController.call are left to it, everything else, including
+    the part requests s3transfer makes from its own threads, keeps
+    botocore's retries.
+    """
+    if getattr(_local, 'controlled', False) and response is not None \
+            and is_throttle_response(response[1]):
+        return False
+    return None
+
+
+class ConcurrencyController:
+    """Additive increase, multiplicative decrease limit on in-flight requests"""
+
+    THROTTLE_CODES = THROTTLE_CODES
+
+    def __init__(self, max_workers, min_workers=1, increase_after=10,
+                 per_prefix=False, max_attempts=8, base_delay=0.2, max_delay=20):
+        """Creates a ConcurrencyController object"""
+        self.max_workers = max_workers
+        self.min_workers = min_workers
+        self.increase_after = increase_after
+        self.per_prefix = per_prefix
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_count = 0
+        self._limits = {}
+        self._condition = threading.Condition()
+
+    def prefix(self, key):
+        """Key prefix a request is tracked under"""
+        if not self.per_prefix or not key:
+            return None
+        return key.split('/', 1)[0] if '/' in key else ''
+
+    def limit(self, key=None):
+        """Current worker limit for a key"""
+        with self._condition:
+            return self._get_limit(self.prefix(key))['limit']
+
+    def _get_limit(self, prefix):
+        if prefix not in self._limits:
+            self._limits[prefix] = {
+                'limit': self.max_workers, 'in_flight': 0, 'successes': 0, 'decreased': 0}
+        return self._limits[prefix]
+
+    @contextmanager
+    def slot(self, key=None):
+        """Wait until the limit allows another request for key"""
+        with self._condition:
+            limit = self._get_limit(self.prefix(key))
+            while limit['in_flight'] >= limit['limit']:
+                self._condition.wait()
+            limit['in_flight'] += 1
+        try:
+            yield limit
+        finally:
+            with self._condition:
+                limit['in_flight'] -= 1
+                self._condition.notify_all()
+
+    def succeeded(self, limit):
+        """Grow the limit by one after enough consecutive successes"""
+        with self._condition:
+            limit['successes'] += 1
+            if limit['successes'] >= self.increase_after \
+                    and limit['limit'] < self.max_workers:
+                limit['limit'] += 1
+                limit['successes'] = 0
+                self._condition.notify_all()
+
+    def throttled(self, limit, started=None):
+        """Halve the limit after a throttling response
+
+        Requests started before the last decrease were sent under the old
+        limit, their throttles belong to the same congestion event and do
+        not halve it again."""
+        with self._condition:
+            self.throttle_count += 1
+            if started is not None and started < limit['decreased']:
+                return
+            run_stats.add('throttle_backoffs')
+            limit['limit'] = max(self.min_workers, limit['limit'] // 2)
+            limit['successes'] = 0
+            limit['decreased'] = time.monotonic()
+
+    def is_throttle(self, error):
+        """True if an error, or the ClientError it wraps, is S3 asking us to slow down"""
+        response = error_response(error)
+        return response is not None and is_throttle_response(response)
+
+    def call(self, func, *args, key=None, **kwargs):
+        """Call func within the limit, backing off and retrying when throttled"""
+        for attempt in range(self.max_attempts):
+            with self.slot(key) as limit:
+                started = time.monotonic()
+                try:
+                    with controlled():
+                        result = func(*args, **kwargs)
+                except Exception as e:
+                    if not self.is_throttle(e) or attempt == self.max_attempts - 1:
+                        raise
+                    self.throttled(limit, started)
+                else:
+                    self.succeeded(limit)
+                    return result
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+            time.sleep(random.uniform(0, delay))
+
+
+class TokenBucket:
+    """Limit bytes per second shared by every transfer thread"""
+
+    def __init__(self, rate, capacity=None):
+        """Creates a TokenBucket object"""
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Block until amount bytes may be sent"""
+        while amount > 0:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                take = min(amount, self.tokens)
+                self.tokens -= take
+                amount -= take
+                wait = amount / self.rate if amount > 0 else 0
+            if wait:
+                time.sleep(min(wait, 1))
+
+    def __call__(self, amount):
+        """Transfer callback, called with the number of bytes just sent"""
+        self.consume(amount)
@@ -1,5 +1,8 @@
+import importlib
 from collections import namedtuple
 
+import click
+
 s3_endpoint = namedtuple('s3_endpoint',  ['region_name', 'url', 'hosted_zone'])
 
 region_endpoint = {
@@ -59,3 +62,57 @@ def get_region(region):
     return region_endpoint[region]
 
 
+size_units = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+              'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+
+def parse_size(size):
+    """Returns bytes for a size such as 500KB or 10MB, raises ValueError otherwise"""
+    text = str(size).strip().upper()
+    number = text.rstrip('KMGB')
+    unit = text[len(number):]
+    if not number or unit not in size_units:
+        raise ValueError("Invalid size {0}".format(size))
+    return int(float(number) * size_units[unit])
+
+
+def size_option(ctx, param, value):
+    """click callback turning a size option into bytes"""
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise click.BadParameter("expected a size such as 500KB or 10MB, got {0}".format(value))
+
+
+def format_size(size):
+    """Returns a size in bytes as a short string such as 1.5GB"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return ('{0:.0f}{1}' if unit == 'B' else '{0:.1f}{1}').format(size, unit)
+
+
+
+
+
+class LazyManager:
+    """Defers importing and creating a manager until it is first used"""
+
+    def __init__(self, module_name, class_name, manager_cfg=None):
+        """Creates a LazyManager object"""
+        self._module_name = module_name
+        self._class_name = class_name
+        self._manager_cfg = manager_cfg if manager_cfg is not None else {}
+        self._manager = None
+
+    def __getattr__(self, name):
+        if self._manager is None:
+            from webotron import clients
+            module = importlib.import_module(self._module_name)
+            manager_class = getattr(module, self._class_name)
+            self._manager = manager_class(
+                clients.get_factory(), **self._manager_cfg)
+        return getattr(self._manager, name)
@@ -0,0 +1,153 @@
+# -*- code utf-8 -*-
+
+"""Filesystem Watchers for Continuous Sync"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+
+class PollingWatcher:
+    """Find changed files by comparing directory snapshots"""
+
+    def __init__(self, root, interval=1.0):
+        """Creates a PollingWatcher object"""
+        self.root = Path(root)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """Modification time and size of every file under root"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def wait(self, timeout=None):
+        """Paths created, changed or removed since the last call"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.scan()
+            changed = {p for p in current.keys() | self.snapshot.keys()
+                       if current.get(p) != self.snapshot.get(p)}
+            self.snapshot = current
+            if changed:
+                return {Path(p) for p in changed}
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None
+                       else max(0, min(self.interval, deadline - time.monotonic())))
+
+    def close(self):
+        return
+
+
+class InotifyWatcher:
+    """Find changed files from Linux inotify events"""
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, root):
+        """Creates an InotifyWatcher object"""
+        self.root = Path(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.overflowed = False
+        self.add_tree(self.root)
+
+    @classmethod
+    def available(cls):
+        """True if this platform provides inotify"""
+        name = ctypes.util.find_library('c')
+        if not name:
+            return False
+        return hasattr(ctypes.CDLL(name), 'inotify_init1')
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = Path(path)
+
+    def add_tree(self, path):
+        """Watch a directory and everything below it, returns files found"""
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(path):
+            self.add_watch(dirpath)
+            files.update(Path(dirpath, name) for name in filenames)
+        return files
+
+    def wait(self, timeout=None):
+        """Paths created, changed or removed since the last call"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+                path = self.watches[wd] / os.fsdecode(name)
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        changed.update(self.add_tree(path))
+                    else:
+                        changed.add(path)
+                else:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(root, poll_interval=1.0, force_polling=False):
+    """An inotify watcher where available, otherwise a polling watcher"""
+    if not force_polling and InotifyWatcher.available():
+        try:
+            return InotifyWatcher(root)
+        except OSError:
+            pass
+    return PollingWatcher(root, poll_interval)
@@ -9,48 +9,73 @@
         - Deploy local files to them
 """
 
-import boto3
-import botocore
 import click
-from botocore.exceptions import ClientError
 from math import floor
 from math import ceil
 
-from webotron.bucket import BucketManager
-from webotron.domain import DomainManager
-from webotron.cert import CertManager
-from webotron.cdn import CloudFrontManager
+from webotron import clients
+from webotron.output import console
 from webotron import util
 
-from pprint import pprint
-
-session = None
-bucket_manager = None
-domain_manager = None
-cert_manager = None
-cdn_manager = None
-client = None
+bucket_cfg = {}
+bucket_manager = util.LazyManager('webotron.bucket', 'BucketManager', bucket_cfg)
+domain_manager = util.LazyManager('webotron.domain', 'DomainManager')
+cert_manager = util.LazyManager('webotron.cert', 'CertManager')
+cdn_manager = util.LazyManager('webotron.cdn', 'CloudFrontManager')
 
 #######################################################################################################
 #######################################################################################################
 #######################################################################################################
 @click.group()
 @click.option('--profile', default=None, help="Use a given AWS profile")
-def cli(profile):
+@click.option('--workers', default=8, help="Number of parallel workers, also sizes the connection pool")
+@click.option('--connect-timeout', default=10, help="Seconds to wait for a connection")
+@click.option('--read-timeout', default=60, help="Seconds to wait for a response")
+@click.option('--tcp-keepalive/--no-tcp-keepalive', default=False, help="Enable TCP keepalive on connections")
+@click.option('--max-bandwidth', default=None, callback=util.size_option, help="Limit upload bandwidth, e.g. 500KB or 10MB per second")
+@click.option('--prefix-throttle', default=False, is_flag=True, help="Track S3 throttling separately per top level prefix")
+@click.option('--upload-state', default=None, help="State file for resumable uploads (default ~/.webotron/uploads.json)")
+@click.option('--region-cache', default=None, help="Bucket region cache file (default ~/.webotron/regions.json)")
+@click.option('--region-ttl', default=86400, help="Seconds before a cached bucket region is looked up again")
+@click.option('--stats', 'show_stats', default=False, is_flag=True, help="Print timings and API call counts when done")
+@click.option('--stats-out', default=None, help="Write stats to a JSON file, or a Prometheus textfile if it ends in .prom")
+@click.option('--profile-out', default=None, help="Write a cProfile dump of the run to this file")
+@click.option('--output', 'output_mode', default='fancy', type=click.Choice(console.MODES), help="How per-object progress is shown")
+@click.pass_context
+def cli(ctx, profile, workers, connect_timeout, read_timeout, tcp_keepalive, max_bandwidth, prefix_throttle, upload_state,
+        region_cache, region_ttl, show_stats, stats_out, profile_out, output_mode):
     """Webotron Synchronizes Local Directories with S3"""
-    global session, bucket_manager, client, domain_manager, cert_manager, cdn_manager
-    session_cfg = {}
-
-    if profile:
-        session_cfg['profile_name'] = profile
-
-    session = boto3.Session(**session_cfg)
-    bucket_manager = BucketManager(session)
-    domain_manager = DomainManager(session)
-    cert_manager = CertManager(session)
-    cdn_manager = CloudFrontManager(session)
-
-    client = boto3.client('s3')
+    console.configure(output_mode)
+    ctx.call_on_close(console.finish)
+    clients.configure(
+        profile_name=profile,
+        workers=workers,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        tcp_keepalive=tcp_keepalive)
+    if max_bandwidth:
+        bucket_cfg['max_bandwidth'] = max_bandwidth
+    bucket_cfg['prefix_throttle'] = prefix_throttle
+    bucket_cfg['upload_state'] = upload_state
+    bucket_cfg['region_cache'] = region_cache
+    bucket_cfg['region_ttl'] = region_ttl
+
+    if profile_out:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        ctx.call_on_close(lambda: profiler.dump_stats(profile_out))
+    if show_stats or stats_out:
+        ctx.call_on_close(lambda: report_stats(show_stats, stats_out))
+
+
+def report_stats(show_stats, stats_out):
+    """Print and write the stats for this run"""
+    from webotron.stats import run_stats
+    if show_stats:
+        run_stats.print_summary()
+    if stats_out:
+        run_stats.write(stats_out)
     
 #######################################################################################################
 #######################################################################################################
@@ -188,32 +213,101 @@ def buckets():
 @buckets.command("sync")
 @click.argument("pathname", type=click.Path(exists=True))
 @click.option("--delete", default=False, is_flag=True, help="Will remove files from bucket that do not exist locally")
+@click.option("--entry-point", "entry_points", multiple=True, help="Pattern for files uploaded after all other files succeed (default *.html, *.htm)")
+@click.option("--abort-stale", default=False, is_flag=True, help="Abort untracked multipart uploads of synced files older than a day")
+@click.argument("bucketnames", nargs=-1, required=True)
+def sync_path(pathname, bucketnames, delete, entry_points, abort_stale):
+    """Synchronize Local Path to one or more S3 Buckets"""
+    bucket_manager.sync_path(pathname, list(bucketnames), delete, entry_points, abort_stale)
+
+    console.message("🔱  "*40)
+    return
+#######################################################################################################
+@buckets.command("watch")
+@click.argument("pathname", type=click.Path(exists=True))
+@click.argument("bucketname")
+@click.option("--delete", default=False, is_flag=True, help="Will remove files from bucket when they are removed locally")
+@click.option("--entry-point", "entry_points", multiple=True, help="Pattern for files uploaded after all other files succeed (default *.html, *.htm)")
+@click.option("--debounce", default=0.2, help="Seconds without changes before a batch is synced")
+@click.option("--poll-interval", default=1.0, help="Seconds between scans when inotify is not available")
+@click.option("--poll", "force_polling", default=False, is_flag=True, help="Scan for changes instead of using inotify")
+def watch_path(pathname, bucketname, delete, entry_points, debounce, poll_interval, force_polling):
+    """Synchronize Local Path to S3 Bucket, then keep syncing changes"""
+    bucket_manager.watch_path(pathname, bucketname, delete, entry_points,
+                              debounce, poll_interval, force_polling)
+
+    console.message("🔱  "*40)
+    return
+#######################################################################################################
+@buckets.command("promote")
+@click.argument("source")
+@click.argument("destination")
+@click.option("--delete", default=False, is_flag=True, help="Will remove objects from destination that do not exist in source")
+def promote_bucket(source, destination, delete):
+    """Copy changed objects from SOURCE bucket to DESTINATION bucket server side"""
+    bucket_manager.promote(source, destination, delete)
+
+    console.message("🔱  "*40)
+    return
+#######################################################################################################
+@buckets.command("pull")
 @click.argument("bucketname")
-def sync_path(pathname, bucketname, delete):
-    """Synchronize Local Path to S3 Bucket"""
-    bucket_manager.sync_path(pathname, bucketname, delete)
+@click.argument("pathname", type=click.Path(file_okay=False))
+@click.option("--delete", default=False, is_flag=True, help="Will remove local files that do not exist in bucket")
+def pull_bucket(bucketname, pathname, delete):
+    """Download objects from S3 Bucket that differ from Local Path"""
+    bucket_manager.pull(bucketname, pathname, delete)
 
-    print("🔱  "*40)
+    console.message("🔱  "*40)
+    return
+#######################################################################################################
+@buckets.command("du")
+@click.argument("bucketname")
+@click.option("--depth", default=1, type=int, help="Number of '/' levels to total by")
+@click.option("--prefix", default='', help="Only count keys starting with prefix")
+def disk_usage(bucketname, depth, prefix):
+    """Total object count and size per prefix of S3 Bucket"""
+    usage = bucket_manager.disk_usage(bucketname, depth, prefix)
+
+    console.message("\t" + ("🗄️    "*21)+"\n")
+    total_count, total_size = 0, 0
+    for key, (count, size) in sorted(usage.items(), key=lambda u: u[1][1], reverse=True):
+        total_count += count
+        total_size += size
+        line = "{0:>10}  {1:>9}  {2}".format(util.format_size(size), count, key or '/')
+        console.item("prefix", key, "\t🗄️    " + line + (" " * (95 - len(line))) + "🗄️\n",
+                     size=size, count=count, bucket=bucketname)
+    line = "{0:>10}  {1:>9}  total".format(util.format_size(total_size), total_count)
+    console.message("\t🗄️    " + line + (" " * (95 - len(line))) + "🗄️\n",
+                    event="total", size=total_size, count=total_count, bucket=bucketname)
+    console.message("\t" + ("🗄️    "*21))
+    console.message("🔱  "*40)
     return
 #######################################################################################################
 @buckets.command("list")
 @click.option("--pattern", default=None, help="Will filter buckets starting with pattern")
-def list_buckets(pattern):
+@click.option("--region", default=None, help="Will filter buckets in region")
+def list_buckets(pattern, region):
     """List all s3 buckets \n
     Will filter buckets with pattern is provided"""
 
     buckets = []
-    print("\t" + ("🗑    "*21)+"\n")
+    console.message("\t" + ("🗑    "*21)+"\n")
     if pattern:
-        for b in bucket_manager.find_bucket(pattern, True):
+        for b in bucket_manager.find_bucket(pattern, True, region=region):
             buckets.append(b)
     else:
-        buckets = bucket_manager.all_buckets()
-    for b in buckets:
-        print("\t🗑    " + b.name + (" " * (95-len(b.name))) + "🗑\n")
+        buckets = list(bucket_manager.all_buckets(region=region))
+    console.start("buckets")
+    for bucket_region, group in sorted(bucket_manager.by_region(buckets).items(), key=lambda g: g[0] or ''):
+        for b in group:
+            line = "{0:<63} {1}".format(b.name, bucket_region or '')
+            console.item("bucket", b.name, "\t🗑    " + line + (" " * (95-len(line))) + "🗑\n",
+                         region=bucket_region)
+    console.finish()
    
-    print("\t" + ("🗑    "*21))
-    print("🔱  "*40)
+    console.message("\t" + ("🗑    "*21))
+    console.message("🔱  "*40)
     return
 #######################################################################################################
 @buckets.command("create")
@@ -330,15 +424,40 @@ def objects():
 #######################################################################################################
 @objects.command("list")
 @click.argument('bucket')
-def list_bucket_objects(bucket):
+@click.option("--prefix", default='', help="Only list keys starting with prefix")
+@click.option("--format", "fmt", default='fancy', type=click.Choice(['fancy', 'jsonl', 'csv']),
+              help="fancy lines, or one record per object as JSON lines or CSV")
+@click.option("--unordered", default=False, is_flag=True,
+              help="Print objects as their pages arrive instead of in key order")
+def list_bucket_objects(bucket, prefix, fmt, unordered):
     """List objects within s3 bucket"""
 
-    print("\t" + ("📄    "*21)+"\n")
-    for okey in bucket_manager.all_objects(bucket):
-        # print("\t\t" + okey.key)
-        print("\t📄    " + okey.key + (" " * (95-len(okey.key))) + "📄\n")
-    print("\t" + ("📄    "*21))
-    print("🔱  "*40)
+    if fmt != 'fancy':
+        import csv
+        import json
+        import sys
+        fields = ('Key', 'Size', 'ETag', 'LastModified', 'StorageClass')
+        writer = csv.writer(sys.stdout)
+        if fmt == 'csv':
+            writer.writerow(fields)
+        for obj in bucket_manager.stream_objects(bucket, prefix, ordered=not unordered):
+            record = [obj['Key'], obj['Size'], obj['ETag'].replace('"', ''),
+                      obj['LastModified'].isoformat(), obj.get('StorageClass', 'STANDARD')]
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                sys.stdout.write(json.dumps(dict(zip(fields, record))) + "\n")
+        return
+
+    console.message("\t" + ("📄    "*21)+"\n")
+    console.start("objects")
+    for obj in bucket_manager.stream_objects(bucket, prefix, ordered=not unordered):
+        # print("\t\t" + obj['Key'])
+        console.item("object", obj['Key'], "\t📄    " + obj['Key'] + (" " * (95-len(obj['Key']))) + "📄\n",
+                     size=obj['Size'], bucket=bucket)
+    console.finish()
+    console.message("\t" + ("📄    "*21))
+    console.message("🔱  "*40)
     return
 #######################################################################################################
 #######################################################################################################
@@ -346,6 +465,7 @@ def list_bucket_objects(bucket):
 
 
 if __name__ == '__main__':
+    from botocore.exceptions import ClientError
     try:
         print("🔱  "*40)
         cli()
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""In-process Rekognition, S3 and DynamoDB Stand-in for Benchmarks
+
+    Answers calls made through a boto3 session from memory by hooking
+    botocore events, so the handlers run unchanged without touching AWS.
+    Rekognition label pages are replayed from resp.json and a fixed
+    latency can be added to every call.
+"""
+
+import copy
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+
+from botocore.response import StreamingBody
+
+RESP = Path(__file__).resolve().parent.parent / 'resp.json'
+
+TABLE_KEYS = {
+    'videos': ('videoName',),
+    'labels': ('videoName', 'segmentStart'),
+    'content': ('contentKey',),
+    'index': ('labelName', 'videoName'),
+    'appearances': ('videoName', 'spanStart'),
+}
+
+INDEX_KEYS = {
+    ('index', 'ByConfidence'): ('labelName', 'Confidence'),
+}
+
+TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),+-]|[#:]?[A-Za-z_][\w.]*)')
+
+
+def scalar(value):
+    """Python value of a wire format attribute, for comparisons"""
+    if value is None:
+        return None
+    kind, data = next(iter(value.items()))
+    if kind == 'N':
+        return Decimal(data)
+    if kind in ('SS', 'NS', 'BS'):
+        return set(data)
+    return data
+
+
+class Expression:
+    """Evaluates the subset of DynamoDB condition and update expressions the handlers use"""
+
+    COMPARE = {'=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+               '<': lambda a, b: a is not None and a < b, '<=': lambda a, b: a is not None and a <= b,
+               '>': lambda a, b: a is not None and a > b, '>=': lambda a, b: a is not None and a >= b}
+
+    def __init__(self, text, names=None, values=None):
+        """Creates an Expression object"""
+        self.tokens = TOKEN.findall(text or '')
+        self.names = names or {}
+        self.values = values or {}
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected and (token or '').upper() != expected:
+            raise ValueError("Expected {0} at {1}".format(expected, token))
+        self.pos += 1
+        return token
+
+    def name(self, token):
+        return self.names.get(token, token)
+
+    def operand(self, item):
+        token = self.take()
+        if token.startswith(':'):
+            return self.values[token]
+        return item.get(self.name(token))
+
+    # Conditions
+
+    def check(self, item):
+        if not self.tokens:
+            return True
+        return self.disjunction(item)
+
+    def disjunction(self, item):
+        result = self.conjunction(item)
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            right = self.conjunction(item)
+            result = result or right
+        return result
+
+    def conjunction(self, item):
+        result = self.factor(item)
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            right = self.factor(item)
+            result = result and right
+        return result
+
+    def factor(self, item):
+        token = self.peek()
+        if token.upper() == 'NOT':
+            self.take()
+            return not self.factor(item)
+        if token == '(':
+            self.take()
+            result = self.disjunction(item)
+            self.take(')')
+            return result
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self.take()
+            self.take('(')
+            exists = self.name(self.take()) in item
+            self.take(')')
+            return exists if token == 'attribute_exists' else not exists
+        if token == 'begins_with':
+            self.take()
+            self.take('(')
+            value = scalar(self.operand(item))
+            self.take(',')
+            prefix = scalar(self.operand(item))
+            self.take(')')
+            return value is not None and value.startswith(prefix)
+        left = scalar(self.operand(item))
+        compare = self.COMPARE[self.take()]
+        right = scalar(self.operand(item))
+        return compare(left, right)
+
+    # Updates
+
+    def apply(self, item):
+        while self.peek():
+            action = self.take().upper()
+            while True:
+                if action == 'SET':
+                    self.set(item)
+                elif action == 'ADD':
+                    self.add(item)
+                elif action == 'REMOVE':
+                    item.pop(self.name(self.take()), None)
+                else:
+                    raise ValueError("Unsupported update action {0}".format(action))
+                if self.peek() != ',':
+                    break
+                self.take()
+        return item
+
+    def set(self, item):
+        path = self.name(self.take())
+        self.take('=')
+        if self.peek() == 'if_not_exists':
+            self.take()
+            self.take('(')
+            current = item.get(self.name(self.take()))
+            self.take(',')
+            value = self.operand(item)
+            self.take(')')
+            value = current if current is not None else value
+        else:
+            value = self.operand(item)
+        if self.peek() in ('+', '-'):
+            sign = 1 if self.take() == '+' else -1
+            other = scalar(self.operand(item))
+            value = {'N': str(scalar(value) + sign * other)}
+        item[path] = value
+
+    def add(self, item):
+        path = self.name(self.take())
+        value = self.operand(item)
+        kind, data = next(iter(value.items()))
+        current = item.get(path)
+        if kind == 'N':
+            total = Decimal(data) + (Decimal(current['N']) if current else 0)
+            item[path] = {'N': str(total)}
+        else:
+            item[path] = {kind: sorted(set(current[kind] if current else []) | set(data))}
+
+
+class Response:
+    """Minimal HTTP response botocore accepts from a before-call hook"""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+        self.raw = None
+
+
+class AWSStub:
+    """In-memory Rekognition, S3 and DynamoDB answering requests made through a boto3 session"""
+
+    def __init__(self, latency=0.0, label_pages=1, table_keys=None, resp_path=RESP, job_limit=None,
+                 index_keys=None):
+        """Creates an AWSStub object"""
+        self.latency = latency
+        self.label_pages = label_pages
+        self.job_limit = job_limit
+        self.table_keys = dict(TABLE_KEYS, **(table_keys or {}))
+        self.index_keys = dict(INDEX_KEYS, **(index_keys or {}))
+        with open(resp_path) as f:
+            self.resp = json.load(f)
+        self.duration = self.resp['Labels'][-1]['Timestamp'] + 1000
+        self.tables = {}
+        self.jobs = {}
+        self.running = set()
+        self.tokens = {}
+        self.objects = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        """Route every call made from session to the stub"""
+        session.events.register_last('before-parameter-build', self._save_params)
+        session.events.register('before-call', self._handle)
+
+    @staticmethod
+    def _save_params(params, context, **kwargs):
+        context['stub_params'] = copy.deepcopy(params)
+
+    def _handle(self, model, context, **kwargs):
+        params = context['stub_params']
+        with self._lock:
+            self.calls[model.name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, 'op_' + model.name, None)
+        if handler is None:
+            return Response(), {}
+        # Responses are parsed in place by boto3, never hand out stored items
+        response, parsed = handler(params)
+        parsed = copy.deepcopy(parsed)
+        if isinstance(parsed.get('Body'), bytes):
+            parsed['Body'] = StreamingBody(io.BytesIO(parsed['Body']), len(parsed['Body']))
+        return response, parsed
+
+    @staticmethod
+    def error(code, status=400):
+        return Response(status), {'Error': {'Code': code, 'Message': code}}
+
+    # Rekognition
+
+    def op_StartLabelDetection(self, params):
+        with self._lock:
+            token = params.get('ClientRequestToken')
+            job_id = self.tokens.get(token)
+            if job_id is None:
+                # Jobs run until their status is first read
+                if self.job_limit is not None and len(self.running) >= self.job_limit:
+                    return self.error('LimitExceededException')
+                job_id = uuid.uuid4().hex
+                self.running.add(job_id)
+            if token:
+                self.tokens[token] = job_id
+            self.jobs[job_id] = dict(params['Video']['S3Object'], JobTag=params.get('JobTag'))
+        return Response(), {'JobId': job_id}
+
+    def op_GetLabelDetection(self, params):
+        with self._lock:
+            self.running.discard(params['JobId'])
+        page_number = int(params.get('NextToken') or 0)
+        offset = page_number * self.duration
+        page = {k: v for k, v in self.resp.items() if k not in ('NextToken', 'ResponseMetadata')}
+        page['Labels'] = [dict(l, Timestamp=l['Timestamp'] + offset) for l in self.resp['Labels']]
+        if page_number + 1 < self.label_pages:
+            page['NextToken'] = str(page_number + 1)
+        return Response(), page
+
+    # S3
+
+    def put_object(self, bucket, key, etag, size, body=b''):
+        with self._lock:
+            self.objects.setdefault(bucket, {})[key] = ('"{0}"'.format(etag), size, body)
+
+    def op_ListObjectsV2(self, params):
+        prefix = params.get('Prefix', '')
+        delimiter = params.get('Delimiter')
+        with self._lock:
+            objects = dict(self.objects.get(params['Bucket'], {}))
+        contents, prefixes = [], set()
+        for key in sorted(k for k in objects if k.startswith(prefix)):
+            if delimiter and delimiter in key[len(prefix):]:
+                prefixes.add(key[:key.index(delimiter, len(prefix)) + len(delimiter)])
+            else:
+                contents.append({'Key': key, 'ETag': objects[key][0], 'Size': objects[key][1]})
+        return Response(), {'Contents': contents, 'KeyCount': len(contents) + len(prefixes),
+                            'CommonPrefixes': [{'Prefix': p} for p in sorted(prefixes)],
+                            'IsTruncated': False}
+
+    def op_PutObject(self, params):
+        body = params.get('Body') or b''
+        body = body.read() if hasattr(body, 'read') else body
+        etag = hashlib.md5(body).hexdigest()
+        self.put_object(params['Bucket'], params['Key'], etag, len(body), body)
+        return Response(), {'ETag': '"{0}"'.format(etag)}
+
+    def op_GetObject(self, params):
+        with self._lock:
+            obj = self.objects.get(params['Bucket'], {}).get(params['Key'])
+        if obj is None:
+            return self.error('NoSuchKey', 404)
+        return Response(), {'Body': obj[2], 'ETag': obj[0], 'ContentLength': obj[1]}
+
+    def op_DeleteObjects(self, params):
+        errors = []
+        with self._lock:
+            objects = self.objects.get(params['Bucket'], {})
+            for obj in params['Delete']['Objects']:
+                if 'ETag' in obj and obj['Key'] in objects and objects[obj['Key']][0] != obj['ETag']:
+                    errors.append({'Key': obj['Key'], 'Code': 'PreconditionFailed'})
+                    continue
+                objects.pop(obj['Key'], None)
+        return Response(), {'Errors': errors}
+
+    # DynamoDB, items are kept in wire format
+
+    def table(self, name):
+        with self._lock:
+            return self.tables.setdefault(name, {})
+
+    def key(self, table_name, item):
+        return tuple(json.dumps(item.get(k), sort_keys=True, default=str)
+                     for k in self.table_keys.get(table_name, sorted(item)[:1]))
+
+    def conditional_check(self, params, item):
+        return Expression(params.get('ConditionExpression'), params.get('ExpressionAttributeNames'),
+                          params.get('ExpressionAttributeValues')).check(item or {})
+
+    def op_PutItem(self, params):
+        table = self.table(params['TableName'])
+        key = self.key(params['TableName'], params['Item'])
+        with self._lock:
+            if not self.conditional_check(params, table.get(key)):
+                return self.error('ConditionalCheckFailedException')
+            table[key] = params['Item']
+        return Response(), {}
+
+    def op_UpdateItem(self, params):
+        table = self.table(params['TableName'])
+        key = self.key(params['TableName'], params['Key'])
+        with self._lock:
+            old = table.get(key)
+            if not self.conditional_check(params, old):
+                return self.error('ConditionalCheckFailedException')
+            new = Expression(params.get('UpdateExpression'), params.get('ExpressionAttributeNames'),
+                             params.get('ExpressionAttributeValues')).apply(dict(old or params['Key']))
+            table[key] = new
+        returns = params.get('ReturnValues', 'NONE')
+        if returns in ('ALL_NEW', 'UPDATED_NEW'):
+            return Response(), {'Attributes': new}
+        if returns in ('ALL_OLD', 'UPDATED_OLD') and old:
+            return Response(), {'Attributes': old}
+        return Response(), {}
+
+    def op_GetItem(self, params):
+        item = self.table(params['TableName']).get(self.key(params['TableName'], params['Key']))
+        return Response(), {'Item': item} if item else {}
+
+    def op_BatchWriteItem(self, params):
+        for table_name, requests in params['RequestItems'].items():
+            table = self.table(table_name)
+            with self._lock:
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        table[self.key(table_name, item)] = item
+                    else:
+                        table.pop(self.key(table_name, request['DeleteRequest']['Key']), None)
+        return Response(), {'UnprocessedItems': {}}
+
+    def op_Query(self, params):
+        table_name = params['TableName']
+        keys = self.table_keys[table_name]
+        sort_keys = self.index_keys.get((table_name, params.get('IndexName')), keys)
+        names = params.get('ExpressionAttributeNames')
+        values = params.get('ExpressionAttributeValues')
+        table = self.table(table_name)
+        with self._lock:
+            items = [item for item in table.values()
+                     if all(k in item for k in sort_keys) and
+                     Expression(params['KeyConditionExpression'], names, values).check(item)]
+
+        def order(item):
+            return tuple(scalar(item[k]) for k in sort_keys[1:] + keys)
+        items.sort(key=order, reverse=not params.get('ScanIndexForward', True))
+        if 'ExclusiveStartKey' in params:
+            last = order(params['ExclusiveStartKey'])
+            items = [i for i in items if (order(i) < last if not params.get('ScanIndexForward', True)
+                                          else order(i) > last)]
+
+        page = items[:params.get('Limit', 1000)]
+        response = {'Items': [i for i in page if Expression(params.get('FilterExpression'), names, values).check(i)],
+                    'ScannedCount': len(page)}
+        response['Count'] = len(response['Items'])
+        if len(page) < len(items):
+            response['LastEvaluatedKey'] = {k: page[-1][k] for k in set(sort_keys + keys)}
+        return Response(), response
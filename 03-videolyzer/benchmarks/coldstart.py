@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Cold and Warm Start Benchmark for the Videolyzer Handlers
+
+    Each cold run launches a fresh interpreter, imports the handler module
+    and invokes one handler against the in-process AWS stub, so init time
+    and the first (client creating) invocation are measured the way Lambda
+    sees them. The same interpreter then runs warm invocations to measure
+    per-record latency once clients are reused.
+
+    python benchmarks/coldstart.py --runs 5 --warm 50 --records 4
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD_SCRIPT = """
+import json, os, sys, time
+t0 = time.perf_counter()
+os.environ.update(VIDEOS_TABLE_NAME='videos', LABELS_TABLE_NAME='labels', CONTENT_TABLE_NAME='content',
+                  LABEL_INDEX_TABLE_NAME='index',
+                  APPEARANCES_TABLE_NAME='appearances',
+                  REKOGNITION_SNS_TOPIC_ARN='arn:aws:sns:us-east-1:0:bench',
+                  REKOGNITION_ROLE_ARN='arn:aws:iam::0:role/bench',
+                  AWS_DEFAULT_REGION='us-east-1', AWS_ACCESS_KEY_ID='bench',
+                  AWS_SECRET_ACCESS_KEY='bench')
+sys.path[:0] = [{root!r} + '/videolyzer', {root!r} + '/benchmarks']
+import boto3
+boto3_import = time.perf_counter() - t0
+from awsstub import AWSStub
+import events
+boto3.setup_default_session()
+AWSStub(latency={latency}, label_pages={pages}).install(boto3.DEFAULT_SESSION)
+t1 = time.perf_counter()
+import handler
+init = boto3_import + time.perf_counter() - t1
+
+if {handler!r} == 'start_processing_video':
+    make_event, invoke = events.s3_event, handler.start_processing_video
+else:
+    make_event, invoke = events.sns_event, handler.handle_label_detection
+
+event = make_event({records})
+t2 = time.perf_counter()
+invoke(event, None)
+first = time.perf_counter() - t2
+
+warm = []
+for n in range({warm}):
+    event = make_event({records}, start=(n + 1) * {records})
+    t3 = time.perf_counter()
+    invoke(event, None)
+    warm.append(time.perf_counter() - t3)
+print('result', json.dumps({{'init': init, 'first': first, 'warm': warm}}))
+"""
+
+
+def run_child(handler, records, warm, pages, latency):
+    """Run one cold start plus warm invocations in a fresh interpreter"""
+    script = CHILD_SCRIPT.format(root=str(ROOT), handler=handler, records=records,
+                                 warm=warm, pages=pages, latency=latency)
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=str(ROOT),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True)
+    for line in result.stdout.splitlines():
+        if line.startswith('result '):
+            return json.loads(line[len('result '):])
+    raise click.ClickException("No timing reported by benchmark script")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+@click.command()
+@click.option('--handler', 'handlers', multiple=True,
+              type=click.Choice(['start_processing_video', 'handle_label_detection']),
+              help="Handler to benchmark, all by default")
+@click.option('--runs', default=5, help="Cold starts (interpreter launches) per handler")
+@click.option('--warm', default=20, help="Warm invocations after each cold start")
+@click.option('--records', default=1, help="Records per event")
+@click.option('--pages', default=1, help="Label pages per Rekognition job")
+@click.option('--latency', default=0.0, help="Seconds added to every stubbed AWS call")
+def coldstart(handlers, runs, warm, records, pages, latency):
+    """Benchmark videolyzer handler init, first invocation and warm latency"""
+    results = {}
+    for handler in handlers or ('start_processing_video', 'handle_label_detection'):
+        children = [run_child(handler, records, warm, pages, latency) for _ in range(runs)]
+        warm_ms = [w * 1000 for c in children for w in c['warm']]
+        results[handler] = {
+            'init_ms': statistics.median(c['init'] * 1000 for c in children),
+            'first_invoke_ms': statistics.median(c['first'] * 1000 for c in children),
+            'warm_p50_ms': percentile(warm_ms, 50) if warm_ms else None,
+            'warm_p99_ms': percentile(warm_ms, 99) if warm_ms else None,
+            'warm_per_record_ms': statistics.mean(warm_ms) / records if warm_ms else None,
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    coldstart()
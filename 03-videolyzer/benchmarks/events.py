@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Lambda Events for Benchmarks
+
+    S3 records are seeded from the captured event in s3-event-sample.py
+    and Rekognition completion messages mirror what SNS delivers to
+    handle_label_detection, directly or wrapped in SQS messages for
+    handle_label_queue. CloudWatch events mirror the Auto Scaling
+    notifications notifon posts to Slack.
+"""
+
+import copy
+import hashlib
+import json
+import runpy
+from pathlib import Path
+
+SAMPLE = Path(__file__).resolve().parent.parent / 's3-event-sample.py'
+
+
+def s3_record(n, sample=None, distinct=False):
+    """An ObjectCreated record for video n, a copy of the sample video unless distinct"""
+    sample = sample or runpy.run_path(str(SAMPLE))['event']
+    record = copy.deepcopy(sample['Records'][0])
+    record['s3']['object']['key'] = 'Bench+Video+{0:05d}.mp4'.format(n)
+    record['s3']['object']['sequencer'] = '{0:018X}'.format(n)
+    if distinct:
+        record['s3']['object']['eTag'] = hashlib.md5(record['s3']['object']['key'].encode()).hexdigest()
+    return record
+
+
+def s3_event(records, start=0, distinct=False):
+    """An S3 event with several ObjectCreated records"""
+    sample = runpy.run_path(str(SAMPLE))['event']
+    return {'Records': [s3_record(start + n, sample, distinct) for n in range(records)]}
+
+
+def sns_record(n, bucket='dev.videolyzer.dmillikan.com', job=None):
+    """A Rekognition job completion message for video n, or for a job started on the stub"""
+    message = {
+        'JobId': 'job-{0:05d}'.format(n),
+        'Status': 'SUCCEEDED',
+        'API': 'StartLabelDetection',
+        'Timestamp': 1568214000000 + n,
+        'Video': {'S3ObjectName': 'Bench Video {0:05d}.mp4'.format(n), 'S3Bucket': bucket}
+    }
+    if job:
+        job_id, video = job
+        message['JobId'] = job_id
+        message['Video'] = {'S3ObjectName': video['Name'], 'S3Bucket': video['Bucket']}
+        if video.get('JobTag'):
+            message['JobTag'] = video['JobTag']
+    return {'EventSource': 'aws:sns', 'EventVersion': '1.0',
+            'Sns': {'Type': 'Notification', 'Message': json.dumps(message)}}
+
+
+def sns_event(records, start=0):
+    """An SNS event with several completion messages"""
+    return {'Records': [sns_record(start + n) for n in range(records)]}
+
+
+def sqs_record(n, bucket='dev.videolyzer.dmillikan.com', job=None):
+    """A completion message for video n delivered from SNS through SQS"""
+    envelope = sns_record(n, bucket, job)['Sns']
+    return {'messageId': '{0:08d}-0000-4000-8000-000000000000'.format(n),
+            'eventSource': 'aws:sqs', 'body': json.dumps(envelope)}
+
+
+def sqs_event(records, start=0):
+    """An SQS event with a batch of completion messages"""
+    return {'Records': [sqs_record(start + n) for n in range(records)]}
+
+
+def cloudwatch_event(n, group='Notifon Example'):
+    """An Auto Scaling instance launch event as CloudWatch Events delivers it"""
+    instance = 'i-{0:017x}'.format(n)
+    return {
+        'version': '0',
+        'id': '{0:08x}-0000-4000-8000-000000000000'.format(n),
+        'detail-type': 'EC2 Instance Launch Successful',
+        'source': 'aws.autoscaling',
+        'account': '123456789012',
+        'time': '2019-09-11T15:{0:02d}:{1:02d}Z'.format(n // 60 % 60, n % 60),
+        'region': 'us-east-1',
+        'resources': ['arn:aws:ec2:us-east-1:123456789012:instance/' + instance],
+        'detail': {
+            'StatusCode': 'InProgress',
+            'AutoScalingGroupName': group,
+            'ActivityId': '{0:08x}-0000-4000-8000-000000000001'.format(n),
+            'RequestId': '{0:08x}-0000-4000-8000-000000000002'.format(n),
+            'EC2InstanceId': instance,
+            'Cause': 'An instance was started in response to a difference between desired and actual capacity',
+            'Description': 'Launching a new EC2 instance: ' + instance,
+            'Details': {'Subnet ID': 'subnet-00000000', 'Availability Zone': 'us-east-1a'}
+        }
+    }
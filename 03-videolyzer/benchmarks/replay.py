@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Replay Benchmark for the Videolyzer and Notifon Handlers
+
+    Builds synthetic S3, SNS, SQS and CloudWatch events and replays them
+    through the Lambda handlers against local stand-ins for Rekognition,
+    DynamoDB, S3 (awsstub.py) and the Slack webhook (slackstub.py), each
+    with its own latency. Every handler is replayed in a fresh interpreter
+    so peak memory is its own, and throughput, latency percentiles and
+    peak RSS are reported per handler.
+
+    python benchmarks/replay.py --events 200 --records 4 --latency 0.005
+"""
+
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+NOTIFIER = ROOT.parent / '02-notifon' / 'notifier'
+
+VIDEOLYZER_HANDLERS = ('start_processing_video', 'handle_label_detection', 'handle_label_queue')
+NOTIFIER_HANDLERS = ('post_to_slack',)
+
+VIDEOLYZER_ENV = {
+    'VIDEOS_TABLE_NAME': 'videos', 'LABELS_TABLE_NAME': 'labels', 'CONTENT_TABLE_NAME': 'content',
+    'LABEL_INDEX_TABLE_NAME': 'index',
+    'APPEARANCES_TABLE_NAME': 'appearances',
+    'REKOGNITION_SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:0:bench',
+    'REKOGNITION_ROLE_ARN': 'arn:aws:iam::0:role/bench',
+    'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench'
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def load_videolyzer(latency, pages):
+    os.environ.update(VIDEOLYZER_ENV)
+    sys.path[:0] = [str(ROOT / 'videolyzer'), str(ROOT / 'benchmarks')]
+    import boto3
+    from awsstub import AWSStub
+    boto3.setup_default_session()
+    stub = AWSStub(latency=latency, label_pages=pages)
+    stub.install(boto3.DEFAULT_SESSION)
+    import handler
+    return handler, stub.calls
+
+
+def load_notifier(slack_latency):
+    sys.path[:0] = [str(NOTIFIER), str(ROOT / 'benchmarks')]
+    from slackstub import SlackStub
+    slack = SlackStub(slack_latency).start()
+    os.environ['SLACK_WEBHOOK_URL'] = slack.url
+    import handler
+    return handler, slack
+
+
+def build_events(handler_name, count, records, distinct):
+    import events
+    if handler_name == 'start_processing_video':
+        return [events.s3_event(records, start=n * records, distinct=distinct) for n in range(count)]
+    if handler_name == 'handle_label_detection':
+        return [events.sns_event(records, start=n * records) for n in range(count)]
+    if handler_name == 'handle_label_queue':
+        return [events.sqs_event(records, start=n * records) for n in range(count)]
+    return [events.cloudwatch_event(n) for n in range(count)]
+
+
+def replay_in_process(handler_name, count, records, pages, latency, slack_latency, warmup, distinct):
+    """Replay count events through one handler in this interpreter"""
+    if handler_name in NOTIFIER_HANDLERS:
+        module, slack = load_notifier(slack_latency)
+        records = 1
+    else:
+        module, calls = load_videolyzer(latency, pages)
+    invoke = getattr(module, handler_name)
+
+    replayed = build_events(handler_name, warmup + count, records, distinct)
+    for event in replayed[:warmup]:
+        invoke(event, None)
+    if handler_name in NOTIFIER_HANDLERS:
+        del slack.messages[:]
+    else:
+        calls.clear()
+    baseline = peak_rss_mb()
+
+    latencies = []
+    started = time.perf_counter()
+    for event in replayed[warmup:]:
+        t0 = time.perf_counter()
+        invoke(event, None)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'events': count,
+        'records': count * records,
+        'seconds': elapsed,
+        'events_per_s': count / elapsed if elapsed else None,
+        'records_per_s': count * records / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - baseline,
+    }
+    if handler_name in NOTIFIER_HANDLERS:
+        result['slack_posts'] = len(slack.messages)
+        slack.stop()
+    else:
+        result['aws_calls'] = dict(calls)
+    return result
+
+
+def run_child(handler_name, count, records, pages, latency, slack_latency, warmup, distinct):
+    """Replay one handler in a fresh interpreter"""
+    args = [sys.executable, __file__, '--child', handler_name, '--events', str(count),
+            '--records', str(records), '--pages', str(pages), '--latency', str(latency),
+            '--slack-latency', str(slack_latency), '--warmup', str(warmup),
+            '--distinct' if distinct else '--same-content']
+    result = subprocess.run(args, cwd=str(ROOT), stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True)
+    for line in result.stdout.splitlines():
+        if line.startswith('result '):
+            return json.loads(line[len('result '):])
+    raise click.ClickException("No result reported by replay of {0}".format(handler_name))
+
+
+@click.command()
+@click.option('--handler', 'handlers', multiple=True,
+              type=click.Choice(VIDEOLYZER_HANDLERS + NOTIFIER_HANDLERS),
+              help="Handler to replay, all by default")
+@click.option('--events', 'count', default=100, help="Events replayed per handler after warm up")
+@click.option('--records', default=1, help="Records per S3, SNS or SQS event")
+@click.option('--pages', default=1, help="Label pages per Rekognition job")
+@click.option('--latency', default=0.0, help="Seconds added to every stubbed AWS call")
+@click.option('--slack-latency', default=0.0, help="Seconds the Slack webhook takes to answer")
+@click.option('--warmup', default=1, help="Events replayed before measuring")
+@click.option('--distinct/--same-content', default=True,
+              help="Give every uploaded video its own content or replay copies of one video")
+@click.option('--child', default=None, hidden=True)
+def replay(handlers, count, records, pages, latency, slack_latency, warmup, distinct, child):
+    """Replay synthetic events through the Lambda handlers and report throughput"""
+    if child:
+        result = replay_in_process(child, count, records, pages, latency, slack_latency, warmup, distinct)
+        print('result', json.dumps(result))
+        return
+
+    results = {}
+    for handler_name in handlers or VIDEOLYZER_HANDLERS + NOTIFIER_HANDLERS:
+        results[handler_name] = run_child(handler_name, count, records, pages, latency,
+                                          slack_latency, warmup, distinct)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    replay()
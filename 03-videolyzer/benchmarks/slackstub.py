@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Local Slack Incoming Webhook for Benchmarks
+
+    A threaded HTTP server on localhost that accepts webhook posts the way
+    Slack does, answering "ok" after a configurable latency, so handlers
+    posting with requests run unchanged.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+
+class SlackStub:
+    """Slack incoming webhook served from a background thread"""
+
+    def __init__(self, latency=0.0):
+        """Creates a SlackStub object"""
+        self.latency = latency
+        self.messages = []
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}/services/T000/B000/bench'.format(host, port)
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.messages.append(json.loads(body or b'{}'))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
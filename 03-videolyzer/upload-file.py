@@ -1,15 +1,103 @@
 from pathlib import Path
+import json
+import os
 import click
 import boto3
+from botocore.exceptions import ClientError
 
 
+PART_SIZE = 8388608
+STATE_FILE = '~/.videolyzer/uploads.json'
+
+
+def load_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state_path, state):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = state_path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+
+def find_upload(client, state, name, bucketname, path):
+    """Saved upload for an unchanged file with parts confirmed by ListParts"""
+    upload = state.get(name)
+    if not upload:
+        return None
+
+    stat = path.stat()
+    if upload['Size'] != stat.st_size or upload['MTime'] != stat.st_mtime:
+        try:
+            client.abort_multipart_upload(Bucket=bucketname, Key=path.name, UploadId=upload['UploadId'])
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise e
+        return None
+
+    parts = {}
+    try:
+        paginator = client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=bucketname, Key=path.name, UploadId=upload['UploadId']):
+            for part in page.get('Parts', []):
+                parts[str(part['PartNumber'])] = part['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchUpload':
+            return None
+        raise e
+    upload['Parts'] = parts
+    return upload
+
+
+def resumable_upload(client, path, bucketname, state_path):
+    """Multipart upload that picks up where an interrupted run stopped"""
+    state = load_state(state_path)
+    name = '{0}/{1}'.format(bucketname, path.name)
+    stat = path.stat()
+
+    upload = find_upload(client, state, name, bucketname, path)
+    if upload:
+        print('Resuming {0}, {1} parts already uploaded'.format(path.name, len(upload['Parts'])))
+    else:
+        response = client.create_multipart_upload(Bucket=bucketname, Key=path.name)
+        upload = {'UploadId': response['UploadId'], 'Size': stat.st_size,
+                  'MTime': stat.st_mtime, 'Parts': {}}
+    state[name] = upload
+    save_state(state_path, state)
+
+    part_count = max(1, -(-stat.st_size // PART_SIZE))
+    with open(path, 'rb') as f:
+        for part_number in range(1, part_count + 1):
+            if str(part_number) in upload['Parts']:
+                continue
+            f.seek((part_number - 1) * PART_SIZE)
+            response = client.upload_part(
+                Bucket=bucketname, Key=path.name, UploadId=upload['UploadId'],
+                PartNumber=part_number, Body=f.read(PART_SIZE))
+            upload['Parts'][str(part_number)] = response['ETag']
+            save_state(state_path, state)
+
+    client.complete_multipart_upload(
+        Bucket=bucketname, Key=path.name, UploadId=upload['UploadId'],
+        MultipartUpload={'Parts': [
+            {'PartNumber': n, 'ETag': upload['Parts'][str(n)]} for n in range(1, part_count + 1)]})
+    del state[name]
+    save_state(state_path, state)
+
 
 @click.option('--profile', default='None', help="User a given AWS profile")
+@click.option('--state', 'state_file', default=STATE_FILE, help="State file used to resume interrupted uploads")
 @click.argument('pathname', type=click.Path(exists=True))
 @click.argument('bucketname')
 
 @click.command()
-def upload_file(profile,pathname,bucketname):
+def upload_file(profile,state_file,pathname,bucketname):
     """Upload to <BUCKETNAME> File <PATHNAME>"""
 
     session_cfg = {}
@@ -21,7 +109,10 @@ def upload_file(profile,pathname,bucketname):
     s3_bucket = s3.Bucket(bucketname)
     path = Path(pathname).expanduser().resolve()
 
-    s3_bucket.upload_file(str(path),str(path.name))
+    if path.stat().st_size > PART_SIZE:
+        resumable_upload(s3.meta.client, path, bucketname, Path(state_file).expanduser())
+    else:
+        s3_bucket.upload_file(str(path),str(path.name))
 
     return
 
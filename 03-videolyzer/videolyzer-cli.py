@@ -0,0 +1,172 @@
+from pathlib import Path
+import os
+import sys
+import click
+import boto3
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'videolyzer'))
+
+
+def load_handler(profile, topic_arn, role_arn, content_table, videos_table=None, index_table=None):
+    # The handler reads its settings from the environment and builds its
+    # clients from the default session, so set both up before importing it
+    session_cfg = {}
+    if profile:
+        session_cfg['profile_name'] = profile
+    boto3.setup_default_session(**session_cfg)
+
+    # Content already analyzed is linked to the labels stored for it, which
+    # reads and writes the videos and index tables
+    settings = {'REKOGNITION_SNS_TOPIC_ARN': topic_arn, 'REKOGNITION_ROLE_ARN': role_arn,
+                'CONTENT_TABLE_NAME': content_table, 'VIDEOS_TABLE_NAME': videos_table,
+                'LABEL_INDEX_TABLE_NAME': index_table}
+    missing = [name for name, value in settings.items() if not value and name not in os.environ]
+    if missing:
+        raise click.UsageError("Missing settings: {0}".format(", ".join(missing)))
+    os.environ.update({name: value for name, value in settings.items() if value})
+
+    import handler
+    return handler
+
+
+def session(profile):
+    session_cfg = {}
+    if profile:
+        session_cfg['profile_name'] = profile
+    return boto3.Session(**session_cfg)
+
+
+def list_videos(s3_client, bucketname, prefix, suffix):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucketname, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].lower().endswith(suffix):
+                yield obj
+
+
+@click.group()
+@click.option('--profile', default=None, help="Use a given AWS profile")
+@click.option('--topic-arn', envvar='REKOGNITION_SNS_TOPIC_ARN', help="SNS topic Rekognition notifies when a job completes")
+@click.option('--role-arn', envvar='REKOGNITION_ROLE_ARN', help="Role Rekognition assumes to publish to the topic")
+@click.option('--content-table', envvar='CONTENT_TABLE_NAME', help="DynamoDB table used to deduplicate videos")
+@click.pass_context
+def cli(ctx, profile, topic_arn, role_arn, content_table):
+    """Videolyzer labels videos stored in S3 with Rekognition"""
+    ctx.obj = {'profile': profile, 'topic_arn': topic_arn, 'role_arn': role_arn,
+               'content_table': content_table}
+
+
+@cli.command('backfill')
+@click.argument('bucketname')
+@click.option('--prefix', default='', help="Only label videos with keys starting with prefix")
+@click.option('--suffix', default='.mp4', help="Only label videos with keys ending with suffix")
+@click.option('--max-in-flight', default=4, help="Most Rekognition jobs running at once")
+@click.option('--poll', default=30.0, help="Seconds between job status checks")
+@click.option('--state', 'state_file', default='~/.videolyzer/backfill.json', help="State file used to resume an interrupted backfill")
+@click.option('--videos-table', envvar='VIDEOS_TABLE_NAME', help="DynamoDB table holding the video headers")
+@click.option('--index-table', envvar='LABEL_INDEX_TABLE_NAME', help="DynamoDB table holding the label index")
+@click.pass_obj
+def backfill(obj, bucketname, prefix, suffix, max_in_flight, poll, state_file, videos_table, index_table):
+    """Label videos already in <BUCKETNAME>"""
+    handler = load_handler(videos_table=videos_table, index_table=index_table, **obj)
+    from scheduler import BackfillState
+    from scheduler import JobScheduler
+
+    scheduler = JobScheduler(max_in_flight=max_in_flight)
+    handler.scheduler = scheduler
+    rekognition = handler.client('rekognition')
+
+    def job_status(job_id):
+        return rekognition.get_label_detection(JobId=job_id, MaxResults=1)['JobStatus']
+
+    videos = (('{0}/{1}'.format(bucketname, obj['Key']),
+               (bucketname, obj['Key'], obj['ETag'], obj['Size']))
+              for obj in list_videos(handler.client('s3'), bucketname, prefix, suffix.lower()))
+    counts = scheduler.run(videos, handler.submit_video, job_status,
+                           BackfillState(state_file), poll=poll)
+    print(", ".join("{0} {1}".format(count, status.lower()) for status, count in counts.items()))
+
+    return
+
+
+@cli.command('find')
+@click.argument('label')
+@click.option('--min-confidence', type=float, default=None, help="Only videos where the label reaches this confidence")
+@click.option('--start', type=int, default=None, help="Only videos where the label is seen after START milliseconds")
+@click.option('--end', type=int, default=None, help="Only videos where the label is seen before END milliseconds")
+@click.option('--limit', default=20, help="Most videos to list")
+@click.option('--index-table', envvar='LABEL_INDEX_TABLE_NAME', required=True, help="DynamoDB table holding the label index")
+@click.pass_obj
+def find(obj, label, min_confidence, start, end, limit, index_table):
+    """Find videos containing <LABEL>, highest confidence first"""
+    import labelindex
+
+    table = session(obj['profile']).resource('dynamodb').Table(index_table)
+
+    for item in labelindex.find_videos(table, label, min_confidence, start, end, limit):
+        print("{0:6.2f}% {1}/{2} from {3} to {4} ms, seen {5} times{6}".format(
+            item['Confidence'], item['videoBucket'], item['videoName'],
+            item['FirstTimestamp'], item['LastTimestamp'], item['Count'],
+            ", labels of " + item['LinkedTo'] if 'LinkedTo' in item else ''))
+
+    return
+
+
+@cli.command('appearances')
+@click.argument('videoname')
+@click.option('--label', default=None, help="Only list appearances of label")
+@click.option('--videos-table', envvar='VIDEOS_TABLE_NAME', required=True, help="DynamoDB table holding the video headers")
+@click.option('--appearances-table', envvar='APPEARANCES_TABLE_NAME', required=True, help="DynamoDB table holding the label appearances")
+@click.pass_obj
+def appearances(obj, videoname, label, videos_table, appearances_table):
+    """List when each label appears in <VIDEONAME>"""
+    from boto3.dynamodb.conditions import Key
+    from labels import LabelDecoder
+
+    dynamodb = session(obj['profile']).resource('dynamodb')
+    header = dynamodb.Table(videos_table).get_item(Key={'videoName': videoname}).get('Item')
+    if header is None:
+        raise click.BadParameter("No labels stored for {0}".format(videoname))
+
+    items = []
+    params = {'KeyConditionExpression': Key('videoName').eq(header.get('LinkedTo', videoname))}
+    while True:
+        page = dynamodb.Table(appearances_table).query(**params)
+        items.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            break
+        params['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    for span in LabelDecoder(header).appearances(items, label):
+        print("{0:8.1f}s to {1:8.1f}s {2:6.2f}% {3}".format(
+            span['Start'] / 1000, span['End'] / 1000, span['Confidence'], span['Name']))
+
+    return
+
+
+@cli.command('compact')
+@click.argument('bucketname')
+@click.option('--prefix', default='labels/', help="Prefix labels are exported under")
+@click.option('--min-files', default=2, help="Only compact partitions with at least this many files")
+@click.pass_obj
+def compact(obj, bucketname, prefix, min_files):
+    """Merge the small label export files in <BUCKETNAME> into one file per partition"""
+    import export
+    if not export.available():
+        raise click.UsageError("Compaction needs pyarrow, install it with pip install pyarrow")
+
+    s3_client = session(obj['profile']).client('s3')
+    partitions = merged = 0
+    for partition in export.list_partitions(s3_client, bucketname, prefix):
+        files = export.compact_partition(s3_client, bucketname, partition, min_files)
+        if files:
+            partitions += 1
+            merged += files
+            print("Merged {0} files in {1}".format(files, partition))
+    print("Compacted {0} partitions from {1} files".format(partitions, merged))
+
+    return
+
+
+if __name__ == '__main__':
+    cli()
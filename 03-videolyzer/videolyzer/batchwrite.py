@@ -0,0 +1,111 @@
+"""Batched DynamoDB Writes Shared by Several Messages
+
+    Items written or deleted for a batch of queue messages are pooled and
+    sent in BatchWriteItem calls of up to 25 requests, whichever message
+    they belong to. Unprocessed items and throttled calls are retried with backoff, and
+    the messages that still have unwritten items are returned so that only
+    they are redelivered. With write_at set, full batches are written as
+    soon as they are pooled, so several threads can stream items through
+    one writer in flat memory.
+"""
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+MAX_BATCH_ITEMS = 25
+RETRY_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                'RequestLimitExceeded', 'InternalServerError')
+
+
+def request_key(request):
+    return request['PutRequest']['Item'] if 'PutRequest' in request else request['DeleteRequest']['Key']
+
+
+class BatchWriter:
+    """Pools puts and deletes from several owners into BatchWriteItem calls"""
+
+    def __init__(self, dynamodb, keys, retries=6, backoff=0.05, max_backoff=2.0, sleep=time.sleep,
+                 write_at=None):
+        """Creates a BatchWriter object, keys maps table names to their key attributes"""
+        self.dynamodb = dynamodb
+        self.keys = keys
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.write_at = write_at
+        self.pending = {}
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    def key(self, table_name, item):
+        return (table_name,) + tuple(item[k] for k in self.keys[table_name])
+
+    def put(self, owner, table_name, item):
+        self.queue(self.key(table_name, item), (owner, table_name, {'PutRequest': {'Item': item}}))
+
+    def delete(self, owner, table_name, key):
+        self.queue(self.key(table_name, key), (owner, table_name, {'DeleteRequest': {'Key': key}}))
+
+    def queue(self, key, write):
+        # Later requests for a key replace earlier ones, a batch may not repeat a key
+        with self._lock:
+            if write[0] in self.failed:
+                return
+            self.pending[key] = write
+            if not self.write_at or len(self.pending) < self.write_at:
+                return
+            chunk = [self.pending.pop(k) for k in list(self.pending)[:MAX_BATCH_ITEMS]]
+        self.write(chunk)
+
+    def fail(self, owner, error):
+        """Report owner as failed, its pending and later writes are dropped"""
+        with self._lock:
+            self.failed.setdefault(owner, error)
+
+    def write(self, chunk):
+        errors = self.write_chunk([w for w in chunk if w[0] not in self.failed])
+        with self._lock:
+            for owner, error in errors.items():
+                self.failed.setdefault(owner, error)
+
+    def flush(self):
+        """Write every pending item, returns {owner: error} for owners with unwritten items"""
+        with self._lock:
+            writes = list(self.pending.values())
+            self.pending = {}
+        for start in range(0, len(writes), MAX_BATCH_ITEMS):
+            self.write(writes[start:start + MAX_BATCH_ITEMS])
+        return dict(self.failed)
+
+    def write_chunk(self, chunk):
+        if not chunk:
+            return {}
+        writes = {self.key(table_name, request_key(request)): (owner, table_name, request)
+                  for owner, table_name, request in chunk}
+        attempt = 0
+        while writes:
+            request = {}
+            for owner, table_name, write in writes.values():
+                request.setdefault(table_name, []).append(write)
+            try:
+                unprocessed = self.dynamodb.batch_write_item(RequestItems=request)['UnprocessedItems']
+                error = 'UnprocessedItems'
+            except ClientError as e:
+                error = e.response['Error']['Code']
+                if error not in RETRY_ERRORS:
+                    return {owner: error for owner, table_name, write in writes.values()}
+                unprocessed = request
+
+            writes = {key: writes[key] for key in (
+                self.key(table_name, request_key(r))
+                for table_name, requests in unprocessed.items() for r in requests)}
+            if writes and attempt >= self.retries:
+                return {owner: error for owner, table_name, write in writes.values()}
+            if writes:
+                self.sleep(min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+                attempt += 1
+        return {}
@@ -0,0 +1,90 @@
+"""Content Deduplication for Videolyzer
+
+    Videos are identified by their S3 ETag and size. The first record for a
+    piece of content claims it with a conditional write and starts the
+    Rekognition job. Later records for the same content, re-uploads under
+    another key or repeated S3 deliveries, are queued as links on the claim
+    and pointed at the existing labels once the job has finished.
+"""
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+PENDING_TTL = 6 * 3600
+
+
+def content_key(etag, size):
+    return '{0}-{1}'.format(etag.strip('"'), size)
+
+
+def claim(table, key, bucket, name):
+    """Claim content for analysis, returns (True, item) for the claimant
+
+    Anyone else gets (False, item) after being added to the links of the
+    existing claim, item['Status'] tells whether its labels are ready.
+    """
+    now = int(time.time())
+    # ClaimId doubles as the Rekognition ClientRequestToken, so resubmitting
+    # a claim returns its job while a new claim after a failure gets a new one
+    item = {'contentKey': key, 'Status': 'PENDING', 'videoName': name,
+            'videoBucket': bucket, 'Created': now, 'ClaimId': uuid.uuid4().hex}
+    try:
+        table.put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(contentKey) OR #s = :failed '
+                                'OR (#s = :pending AND Created < :stale)',
+            ExpressionAttributeNames={'#s': 'Status'},
+            ExpressionAttributeValues={':failed': 'FAILED', ':pending': 'PENDING',
+                                       ':stale': now - PENDING_TTL})
+        return True, item
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise e
+
+    item = table.update_item(
+        Key={'contentKey': key},
+        UpdateExpression='ADD Links :link',
+        ExpressionAttributeValues={':link': {link_name(bucket, name)}},
+        ReturnValues='ALL_NEW')['Attributes']
+    return False, item
+
+
+def unsubmitted(item, bucket, name):
+    """True for a retried record of a claimant that never recorded its job"""
+    return (item['Status'] == 'PENDING' and 'JobId' not in item and
+            (item['videoBucket'], item['videoName']) == (bucket, name))
+
+
+def analyzed_as(item, bucket, name):
+    """True if (bucket, name) is the video the content of a claim was analyzed as"""
+    return (item['videoBucket'], item['videoName']) == (bucket, name)
+
+
+def started(table, key, job_id):
+    table.update_item(
+        Key={'contentKey': key},
+        UpdateExpression='SET JobId = :job',
+        ExpressionAttributeValues={':job': job_id})
+
+
+def finish(table, key, status):
+    """Record the outcome of a job, returns the claim with every link queued on it"""
+    return table.update_item(
+        Key={'contentKey': key},
+        UpdateExpression='SET #s = :status, Finished = :now',
+        ExpressionAttributeNames={'#s': 'Status'},
+        ExpressionAttributeValues={':status': status, ':now': int(time.time())},
+        ReturnValues='ALL_NEW')['Attributes']
+
+
+def link_name(bucket, name):
+    return '{0}/{1}'.format(bucket, name)
+
+
+def links(item):
+    """(bucket, name) of every linked video other than the analyzed one"""
+    analyzed = link_name(item['videoBucket'], item['videoName'])
+    return [tuple(link.split('/', 1)) for link in sorted(item.get('Links', ()))
+            if link != analyzed]
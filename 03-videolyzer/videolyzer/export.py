@@ -0,0 +1,185 @@
+"""Columnar Export of Labels for Analytics
+
+    Label sightings of each analyzed video are written as Parquet files to
+    an S3 prefix, partitioned as date=YYYY-MM-DD/label=NAME/ so queries can
+    prune by day and label and read only the columns they need. Each video
+    adds one small part file per label, compact_partition merges the parts
+    of a partition into a single file.
+
+    A video is exported under the same date every time, so exporting it
+    again overwrites its parts. Labels it no longer has get an empty part
+    naming the video in its metadata, which drops the rows of its earlier
+    export when the partition is compacted.
+
+    pyarrow is optional, without it export and compaction are unavailable.
+"""
+import datetime
+import hashlib
+import io
+import urllib.parse
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+PART_PREFIX = 'part-'
+COMPACTED_PREFIX = 'compacted-'
+
+
+def available():
+    return pyarrow is not None
+
+
+class LabelColumns:
+    """Label sightings of a video gathered into arrays while its pages are read"""
+
+    def __init__(self):
+        """Creates a LabelColumns object"""
+        self.names = []
+        self.ids = {}
+        self.name_ids = array('H')
+        self.timestamps = array('I')
+        self.confidences = array('f')
+        self.instances = array('H')
+
+    def collect(self, pages):
+        """Yield pages unchanged, keeping the labels of each"""
+        for page in pages:
+            for label in page['Labels']:
+                name = label['Label']['Name']
+                if name not in self.ids:
+                    self.ids[name] = len(self.names)
+                    self.names.append(name)
+                self.name_ids.append(self.ids[name])
+                self.timestamps.append(label['Timestamp'])
+                self.confidences.append(label['Label']['Confidence'])
+                self.instances.append(len(label['Label'].get('Instances', [])))
+            yield page
+
+    def by_label(self):
+        """{name: row numbers} of every label seen"""
+        rows = {}
+        for row, name_id in enumerate(self.name_ids):
+            rows.setdefault(self.names[name_id], []).append(row)
+        return rows
+
+
+def partition(prefix, date, label):
+    return '{0}date={1}/label={2}/'.format(prefix, date.isoformat(), urllib.parse.quote(label, safe=''))
+
+
+def part_key(partition_prefix, video_bucket, video_name):
+    # Named after the video so exporting it again replaces its part
+    digest = hashlib.sha1('{0}/{1}'.format(video_bucket, video_name).encode()).hexdigest()
+    return '{0}{1}{2}.parquet'.format(partition_prefix, PART_PREFIX, digest)
+
+
+def part_table(video_name, video_bucket, label, timestamps=(), confidences=(), instances=()):
+    # The video is kept in the schema metadata too, so an empty part still
+    # says which video it replaces
+    table = pyarrow.table({
+        'video_name': pyarrow.array([video_name] * len(timestamps), pyarrow.string()),
+        'video_bucket': pyarrow.array([video_bucket] * len(timestamps), pyarrow.string()),
+        'label': pyarrow.array([label] * len(timestamps), pyarrow.string()),
+        'timestamp': pyarrow.array(timestamps, pyarrow.uint32()),
+        'confidence': pyarrow.array(confidences, pyarrow.float32()),
+        'instances': pyarrow.array(instances, pyarrow.uint16())
+    })
+    return table.replace_schema_metadata({'video_name': video_name, 'video_bucket': video_bucket})
+
+
+def part_video(part):
+    # (video name, video bucket) a part holds, parts written before the
+    # metadata was added name it in their rows only
+    metadata = part.schema.metadata or {}
+    if b'video_name' in metadata:
+        return metadata[b'video_name'].decode(), metadata[b'video_bucket'].decode()
+    if part.num_rows:
+        return part['video_name'][0].as_py(), part['video_bucket'][0].as_py()
+    return None
+
+
+def to_parquet(table):
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(table, buffer, compression='zstd')
+    return buffer.getvalue()
+
+
+def write_video(s3_client, bucket, prefix, columns, video_name, video_bucket, date=None, dropped=(), workers=8):
+    """Write one part file per label of a video and an empty one per dropped label, returns the keys written
+
+    dropped are labels an earlier export of the video under the same date had."""
+    date = date or datetime.datetime.utcnow().date()
+    labels = columns.by_label()
+    labels.update((label, []) for label in dropped if label not in labels)
+
+    def write_label(label_rows):
+        label, rows = label_rows
+        table = part_table(video_name, video_bucket, label,
+                           [columns.timestamps[r] for r in rows],
+                           [columns.confidences[r] for r in rows],
+                           [columns.instances[r] for r in rows])
+        key = part_key(partition(prefix, date, label), video_bucket, video_name)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=to_parquet(table))
+        return key
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(write_label, sorted(labels.items())))
+
+
+def list_partitions(s3_client, bucket, prefix):
+    """Yield the date=/label=/ prefixes under prefix"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for dates in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        for date in dates.get('CommonPrefixes', []):
+            for labels in paginator.paginate(Bucket=bucket, Prefix=date['Prefix'], Delimiter='/'):
+                for label in labels.get('CommonPrefixes', []):
+                    yield label['Prefix']
+
+
+def compact_partition(s3_client, bucket, partition_prefix, min_files=2):
+    """Merge the Parquet files of a partition into one, returns the number of files merged"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    keys = [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=partition_prefix)
+            for obj in page.get('Contents', []) if obj['Key'].endswith('.parquet')]
+    if len(keys) < min_files:
+        return 0
+
+    def read(key):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return key, response['ETag'], pyarrow.parquet.read_table(io.BytesIO(response['Body'].read()))
+
+    files = [read(k) for k in keys]
+    parts = [table for key, _, table in files if key[len(partition_prefix):].startswith(PART_PREFIX)]
+    compacted = [table for key, _, table in files if not key[len(partition_prefix):].startswith(PART_PREFIX)]
+
+    # A part holds a single video, it replaces any earlier export of that
+    # video already merged into a compacted file
+    for part in parts:
+        video = part_video(part)
+        if video:
+            compacted = [t.filter(pyarrow.compute.invert(pyarrow.compute.and_(
+                pyarrow.compute.equal(t['video_name'], video[0]),
+                pyarrow.compute.equal(t['video_bucket'], video[1])))) for t in compacted]
+
+    merged = pyarrow.concat_tables([t.replace_schema_metadata(None) for t in compacted + parts])
+    if merged.num_rows:
+        merged = merged.sort_by([('video_name', 'ascending'), ('timestamp', 'ascending')])
+        key = '{0}{1}{2}.parquet'.format(partition_prefix, COMPACTED_PREFIX, uuid.uuid4().hex)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=to_parquet(merged))
+
+    # The merged file is in place before its inputs go, readers may see rows
+    # twice for a moment but never miss any. Each input is only deleted while
+    # it still has the ETag it was read with, a part a video export rewrote
+    # meanwhile stays and replaces the rows merged from it next time
+    for start in range(0, len(files), 1000):
+        s3_client.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': k, 'ETag': etag} for k, etag, _ in files[start:start + 1000]], 'Quiet': True})
+    return len(keys)
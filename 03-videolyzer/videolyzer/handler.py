@@ -1,21 +1,100 @@
-import urllib
+import urllib.parse
 import boto3
 import os
 import json
+import threading
+import time
+import datetime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from labels import LabelDecoder
+from labels import LabelEncoder
+import dedupe
+import export
+import labelindex
+from batchwrite import BatchWriter
+from batchwrite import MAX_BATCH_ITEMS
+from scheduler import JobScheduler
+
+
+SEGMENT_MILLIS = int(os.environ.get('LABEL_SEGMENT_MILLIS', 10000))
+MAX_LABELS_PER_ITEM = 1000
+MAX_SPANS_PER_ITEM = 1000
+CONFIDENCE_PRECISION = float(os.environ.get('LABEL_CONFIDENCE_PRECISION', 0.01))
+APPEARANCE_GAP_MILLIS = int(os.environ.get('LABEL_APPEARANCE_GAP_MILLIS', 1000))
+APPEARANCE_MIN_CONFIDENCE = float(os.environ.get('LABEL_APPEARANCE_MIN_CONFIDENCE', 50))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))
+SUBMIT_TIMEOUT = float(os.environ.get('SUBMIT_TIMEOUT', 60))
+EXPORT_BUCKET = os.environ.get('LABEL_EXPORT_BUCKET')
+EXPORT_PREFIX = os.environ.get('LABEL_EXPORT_PREFIX', 'labels/')
+
+if EXPORT_BUCKET and not export.available():
+    print("pyarrow is not installed, labels will not be exported to {0}".format(EXPORT_BUCKET))
+    EXPORT_BUCKET = None
+
+scheduler = JobScheduler()
+
+# Clients are created on first use and then reused for the life of the
+# container, so warm invocations skip endpoint and credential resolution
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def client(service):
+    if service not in _clients:
+        with _clients_lock:
+            if service not in _clients:
+                _clients[service] = boto3.client(service)
+    return _clients[service]
+
+
+def resource(service):
+    name = service + ':resource'
+    if name not in _clients:
+        with _clients_lock:
+            if name not in _clients:
+                _clients[name] = boto3.resource(service)
+    return _clients[name]
+
+
+def process_records(records, process):
+    # Run process on every record concurrently, then report each failure and
+    # raise once so the invocation is retried only after all records ran
+    if len(records) == 1:
+        results = [run_record(process, records[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(records))) as executor:
+            results = list(executor.map(lambda r: run_record(process, r), records))
+
+    failures = [error for error in results if error]
+    for error in failures:
+        print(json.dumps(error))
+    if failures:
+        raise RuntimeError("{0} of {1} records failed".format(len(failures), len(records)))
+    return len(records)
+
+
+def run_record(process, record):
+    try:
+        process(record)
+    except Exception as e:
+        return {'record': record, 'error': '{0}: {1}'.format(type(e).__name__, e)}
+    return None
 
 
 def get_video_labels(job_id):
 
-    rekognition_client = boto3.client('rekognition') 
-    response = rekognition_client.get_label_detection(JobId=job_id)
-    
-    next_token = response.get('NextToken', None)
+    rekognition_client = client('rekognition')
+    params = {'JobId': job_id, 'MaxResults': 1000, 'SortBy': 'TIMESTAMP'}
 
-    while next_token:
-        next_page = rekognition_client.get_label_detection(JobId=job_id, NextToken=next_token)
-        next_token = next_page.get('NextToken', None)
-        response['Labels'].extend(next_page['Labels'])
-    return response
+    while True:
+        page = rekognition_client.get_label_detection(**params)
+        yield page
+        next_token = page.get('NextToken', None)
+        if not next_token:
+            break
+        params['NextToken'] = next_token
 
 def make_item(data):
 
@@ -31,30 +110,185 @@ def make_item(data):
     return data
 
 
-def put_labels_in_db(data, video_name, video_bucket):
-    del data['ResponseMetadata']
-    del data['JobStatus']
-    
-    data['videoName'] = video_name
-    data['videoBucket'] = video_bucket
-
-    dynamodb = boto3.resource('dynamodb')
-    table_name = os.environ['VIDEOS_TABLE_NAME']
+def from_item(data):
+    # Plain JSON types for an item read back through the DynamoDB resource
+    if isinstance(data, dict):
+        return {k: from_item(v) for k, v in data.items()}
 
-    # print(data)
-    # print(video_name)
-    videos_table = dynamodb.Table(table_name)
-    data = make_item(data)
-    videos_table.put_item(Item=data)
+    if isinstance(data, (list, set)):
+        return [from_item(v) for v in data]
 
+    if isinstance(data, Decimal):
+        return int(data) if data == data.to_integral_value() else float(data)
 
-    
-    return
-
+    return data
 
-def start_label_detection(bucket, key):
 
-    rekognition_client = boto3.client('rekognition')
+def label_segments(pages):
+    # Group the label stream into items covering SEGMENT_MILLIS of video each,
+    # keyed by the timestamp of their first label so they sort by time
+    labels = []
+    start = last_key = None
+    for page in pages:
+        for label in page['Labels']:
+            timestamp = label['Timestamp']
+            if labels and (timestamp >= start + SEGMENT_MILLIS or len(labels) >= MAX_LABELS_PER_ITEM):
+                yield last_key, labels
+                labels = []
+            if not labels:
+                start = timestamp - timestamp % SEGMENT_MILLIS
+                last_key = timestamp if last_key is None else max(timestamp, last_key + 1)
+            labels.append(label)
+    if labels:
+        yield last_key, labels
+
+
+def label_items(pages, video_name, video_bucket, header, appearances):
+    # Yield the label segment items of a video, header is filled in with the
+    # video metadata and summary and appearances with the appearance items
+    # once every page has been read
+    encoder = LabelEncoder(CONFIDENCE_PRECISION, APPEARANCE_GAP_MILLIS, APPEARANCE_MIN_CONFIDENCE)
+    segments = 0
+    label_count = 0
+
+    def header_pages():
+        for page in pages:
+            if not header:
+                header.update({k: v for k, v in page.items()
+                               if k not in ('Labels', 'NextToken', 'ResponseMetadata', 'JobStatus')})
+            yield page
+
+    for segment_start, labels in label_segments(header_pages()):
+        item = encoder.encode(labels)
+        item['videoName'] = video_name
+        item['segmentStart'] = segment_start
+        yield item
+        segments += 1
+        label_count += len(labels)
+
+    header['videoName'] = video_name
+    header['videoBucket'] = video_bucket
+    header['Segments'] = segments
+    header['LabelCount'] = label_count
+    header['SegmentMillis'] = SEGMENT_MILLIS
+    header.update(encoder.header())
+    for item in encoder.appearance_items(MAX_SPANS_PER_ITEM):
+        item['videoName'] = video_name
+        appearances.append(item)
+
+
+def video_items(table, video_name, **params):
+    # Every item stored for a video in a table keyed by videoName and a sort key
+    params['KeyConditionExpression'] = Key('videoName').eq(video_name)
+    while True:
+        page = table.query(**params)
+        yield from page['Items']
+        if 'LastEvaluatedKey' not in page:
+            return
+        params['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def stale_items(table, sort_key, video_name, items):
+    # Keys of items left from an earlier analysis of the video that the new
+    # items do not overwrite
+    written = {item[sort_key] for item in items}
+    return [{'videoName': video_name, sort_key: item[sort_key]}
+            for item in video_items(table, video_name, ProjectionExpression=sort_key)
+            if item[sort_key] not in written]
+
+
+def stored_header(video_name):
+    videos_table = resource('dynamodb').Table(os.environ['VIDEOS_TABLE_NAME'])
+    return videos_table.get_item(Key={'videoName': video_name}).get('Item')
+
+
+def stale_index_keys(video_name, header):
+    # Index keys of labels the stored header of a video lists and header does
+    # not, read before header replaces it
+    return labelindex.stale_keys(video_name, stored_header(video_name), header)
+
+
+def replace_header(video_name, header):
+    # Read the stored header of a video before header replaces it, carrying
+    # over the day the video was first analyzed, which its labels are
+    # exported under, returns the index keys of labels it no longer has
+    old_header = stored_header(video_name)
+    header['AnalyzedDate'] = (old_header or {}).get('AnalyzedDate') or datetime.datetime.utcnow().date().isoformat()
+    return labelindex.stale_keys(video_name, old_header, header)
+
+
+def put_labels_in_db(pages, video_name, video_bucket):
+    dynamodb = resource('dynamodb')
+    videos_table = dynamodb.Table(os.environ['VIDEOS_TABLE_NAME'])
+    labels_table = dynamodb.Table(os.environ['LABELS_TABLE_NAME'])
+    appearances_table = dynamodb.Table(os.environ['APPEARANCES_TABLE_NAME'])
+
+    header = {}
+    appearances = []
+    written = []
+    with labels_table.batch_writer(overwrite_by_pkeys=['videoName', 'segmentStart']) as batch:
+        for item in label_items(pages, video_name, video_bucket, header, appearances):
+            batch.put_item(Item=item)
+            written.append({'segmentStart': item['segmentStart']})
+    with appearances_table.batch_writer(overwrite_by_pkeys=['videoName', 'spanStart']) as batch:
+        for item in appearances:
+            batch.put_item(Item=item)
+    stale_index = replace_header(video_name, header)
+    videos_table.put_item(Item=make_item(header))
+    with labels_table.batch_writer() as batch:
+        for key in stale_items(labels_table, 'segmentStart', video_name, written):
+            batch.delete_item(Key=key)
+    with appearances_table.batch_writer() as batch:
+        for key in stale_items(appearances_table, 'spanStart', video_name, appearances):
+            batch.delete_item(Key=key)
+    put_index_items(labelindex.index_items(video_name, video_bucket, header), stale_index)
+
+    return header, stale_index
+
+
+def put_index_items(items, stale=()):
+    # Stale index items of labels a video no longer has go first
+    index_table = resource('dynamodb').Table(os.environ['LABEL_INDEX_TABLE_NAME'])
+    with index_table.batch_writer(overwrite_by_pkeys=['labelName', 'videoName']) as batch:
+        for key in stale:
+            batch.delete_item(Key=key)
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def link_items(video_name, links, header):
+    for bucket, name in links:
+        yield dict(make_item(header), videoName=name, videoBucket=bucket,
+                   LinkedTo=header.get('LinkedTo', video_name))
+
+
+def link_index_items(video_name, links, header):
+    for bucket, name in links:
+        yield from labelindex.index_items(name, bucket, header, header.get('LinkedTo', video_name))
+
+
+def link_labels(video_name, links, header=None):
+    # Point other copies of a video at the labels already stored for it
+    videos_table = resource('dynamodb').Table(os.environ['VIDEOS_TABLE_NAME'])
+    if header is None:
+        header = videos_table.get_item(Key={'videoName': video_name})['Item']
+
+    stale = []
+    for item in link_items(video_name, links, header):
+        stale.extend(stale_index_keys(item['videoName'], header))
+        videos_table.put_item(Item=item)
+        print("Linked {0}/{1} to labels of {2}".format(item['videoBucket'], item['videoName'], item['LinkedTo']))
+    put_index_items(link_index_items(video_name, links, header), stale)
+
+
+def start_label_detection(bucket, key, content_key=None, token=None):
+
+    rekognition_client = client('rekognition')
+    params = {}
+    if content_key:
+        params['JobTag'] = content_key
+    if token:
+        params['ClientRequestToken'] = token
 
     response = rekognition_client.start_label_detection(
         Video={
@@ -66,40 +300,260 @@ def start_label_detection(bucket, key):
         NotificationChannel={
             'SNSTopicArn': os.environ['REKOGNITION_SNS_TOPIC_ARN'],
             'RoleArn': os.environ['REKOGNITION_ROLE_ARN']
-        })
+        },
+        **params)
 
 
     print(response)
     
-    return 
+    return response['JobId']
+
+def submit_video(bucket, key, etag=None, size=None, deadline=None):
+    # Start a job for a video unless its content is already analyzed or
+    # being analyzed, returns the job id or None when no job was needed
+    if etag is None:
+        return scheduler.submit(start_label_detection, bucket, key, deadline=deadline)
+
+    content_key = dedupe.content_key(etag, size)
+    content_table = resource('dynamodb').Table(os.environ['CONTENT_TABLE_NAME'])
+    claimed, item = dedupe.claim(content_table, content_key, bucket, key)
+    if not claimed and not dedupe.unsubmitted(item, bucket, key):
+        if item['Status'] == 'SUCCEEDED' and dedupe.analyzed_as(item, bucket, key):
+            print("{0}/{1} is already analyzed".format(bucket, key))
+        elif item['Status'] == 'SUCCEEDED':
+            link_labels(item['videoName'], [(bucket, key)])
+        else:
+            print("{0}/{1} is already being analyzed as {2}".format(bucket, key, item['videoName']))
+        return None
+
+    try:
+        job_id = scheduler.submit(start_label_detection, bucket, key, content_key,
+                                  item['ClaimId'], deadline=deadline)
+    except Exception:
+        dedupe.finish(content_table, content_key, 'FAILED')
+        raise
+    dedupe.started(content_table, content_key, job_id)
+    return job_id
+
+
+def process_video_record(record):
+    s3_object = record['s3']['object']
+    submit_video(
+        record['s3']['bucket']['name'],
+        urllib.parse.unquote_plus(s3_object['key']),
+        s3_object.get('eTag'),
+        s3_object.get('size'),
+        deadline=time.monotonic() + SUBMIT_TIMEOUT
+    )
+
 
 def start_processing_video(event, context):
-    for record in event['Records']:
-        start_label_detection(
-            record['s3']['bucket']['name'],
-            urllib.parse.unquote_plus(record['s3']['object']['key'])
-        )
+    process_records(event['Records'], process_video_record)
 
     return
 
 
-def handle_label_detection(event,context):
+def label_message(record):
+    # Completion messages come straight from SNS or through SQS, where the
+    # body is the SNS envelope unless raw message delivery is turned on
+    if 'Sns' in record:
+        return json.loads(record['Sns']['Message'])
+    body = json.loads(record['body'])
+    return json.loads(body['Message']) if 'Message' in body else body
 
-    for record in event['Records']:
-        message = json.loads(record['Sns']['Message'])
-        job_id = message['JobId']
-        s3_bucket = message['Video']['S3Bucket']
-        s3_object = message['Video']['S3ObjectName']
 
-        response = get_video_labels(job_id)
-      
-        put_labels_in_db(response, s3_object, s3_bucket)
+def job_failed(message, content_table):
+    if message.get('Status', 'SUCCEEDED') == 'SUCCEEDED':
+        return False
+    if message.get('JobTag'):
+        dedupe.finish(content_table, message['JobTag'], 'FAILED')
+    print("Label detection job {0} for {1}/{2} ended with {3}".format(
+        message['JobId'], message['Video']['S3Bucket'], message['Video']['S3ObjectName'], message['Status']))
+    return True
 
-    return
 
+def export_labels(columns, header, stale_index=()):
+    # Partition by the day the video was first analyzed, so exporting it
+    # again replaces its parts rather than adding to another day, labels
+    # with stale index keys are ones it no longer has
+    date = datetime.datetime.strptime(header['AnalyzedDate'], '%Y-%m-%d').date()
+    keys = export.write_video(client('s3'), EXPORT_BUCKET, EXPORT_PREFIX, columns,
+                              header['videoName'], header['videoBucket'], date,
+                              [key['labelName'] for key in stale_index])
+    print("Exported labels of {0}/{1} to {2} files".format(header['videoBucket'], header['videoName'], len(keys)))
+
+
+def process_label_record(record):
+    message = label_message(record)
+    job_id = message['JobId']
+    s3_bucket = message['Video']['S3Bucket']
+    s3_object = message['Video']['S3ObjectName']
+    content_key = message.get('JobTag')
+    content_table = resource('dynamodb').Table(os.environ['CONTENT_TABLE_NAME'])
+
+    if job_failed(message, content_table):
+        return
+
+    pages = get_video_labels(job_id)
+    columns = export.LabelColumns() if EXPORT_BUCKET else None
+    if columns:
+        pages = columns.collect(pages)
 
+    header, stale_index = put_labels_in_db(pages, s3_object, s3_bucket)
 
+    if columns:
+        export_labels(columns, header, stale_index)
 
+    if content_key:
+        item = dedupe.finish(content_table, content_key, 'SUCCEEDED')
+        link_labels(s3_object, dedupe.links(item), header)
 
 
+def handle_label_detection(event,context):
+    process_records(event['Records'], process_label_record)
+
+    return
+
 
+def read_label_record(record, writer, owner):
+    # Stream the segment and appearance items of a finished job into writer
+    # as owner, returns the message with its header, export columns and the
+    # (table, key) pairs of segments, appearances and index items left from
+    # an earlier analysis, or None when the job failed
+    message = label_message(record)
+    if job_failed(message, resource('dynamodb').Table(os.environ['CONTENT_TABLE_NAME'])):
+        return None
+
+    header = {}
+    video = message['Video']
+    pages = get_video_labels(message['JobId'])
+    columns = export.LabelColumns() if EXPORT_BUCKET else None
+    if columns:
+        pages = columns.collect(pages)
+    labels_table_name = os.environ['LABELS_TABLE_NAME']
+    appearances_table_name = os.environ['APPEARANCES_TABLE_NAME']
+    index_table_name = os.environ['LABEL_INDEX_TABLE_NAME']
+    appearances = []
+    written = []
+    for item in label_items(pages, video['S3ObjectName'], video['S3Bucket'], header, appearances):
+        writer.put(owner, labels_table_name, item)
+        written.append({'segmentStart': item['segmentStart']})
+    for item in appearances:
+        writer.put(owner, appearances_table_name, item)
+    stale = [(labels_table_name, key) for key in stale_items(
+        resource('dynamodb').Table(labels_table_name), 'segmentStart', video['S3ObjectName'], written)]
+    stale.extend((appearances_table_name, key) for key in stale_items(
+        resource('dynamodb').Table(appearances_table_name), 'spanStart', video['S3ObjectName'], appearances))
+    stale.extend((index_table_name, key) for key in replace_header(video['S3ObjectName'], header))
+    return message, header, columns, stale
+
+
+def handle_label_queue(event, context):
+    # Labels of every message in the batch are read concurrently and their
+    # segments and appearances streamed into shared BatchWriteItem calls as
+    # they are read. Headers follow once those are in, together with deletes
+    # of segments, appearances and index items left from an earlier
+    # analysis, links last, then labels are exported. Only messages with a
+    # failed step are reported back so SQS redelivers just those.
+    records = {record['messageId']: record for record in event['Records']}
+    failed = {}
+    videos = {}
+
+    videos_table_name = os.environ['VIDEOS_TABLE_NAME']
+    labels_table_name = os.environ['LABELS_TABLE_NAME']
+    appearances_table_name = os.environ['APPEARANCES_TABLE_NAME']
+    index_table_name = os.environ['LABEL_INDEX_TABLE_NAME']
+    content_table = resource('dynamodb').Table(os.environ['CONTENT_TABLE_NAME'])
+    writer = BatchWriter(resource('dynamodb'), {videos_table_name: ('videoName',),
+                                                labels_table_name: ('videoName', 'segmentStart'),
+                                                appearances_table_name: ('videoName', 'spanStart'),
+                                                index_table_name: ('labelName', 'videoName')},
+                         write_at=MAX_BATCH_ITEMS)
+
+    def read(message_id):
+        try:
+            return message_id, read_label_record(records[message_id], writer, message_id), None
+        except Exception as e:
+            error = '{0}: {1}'.format(type(e).__name__, e)
+            writer.fail(message_id, error)
+            return message_id, None, error
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(records)))) as executor:
+        for message_id, video, error in executor.map(read, records):
+            if error:
+                failed[message_id] = error
+            elif video:
+                videos[message_id] = video
+
+    failed.update(writer.flush())
+
+    for message_id, (message, header, columns, stale) in videos.items():
+        if message_id not in failed:
+            writer.put(message_id, videos_table_name, make_item(header))
+            for table_name, key in stale:
+                writer.delete(message_id, table_name, key)
+            for item in labelindex.index_items(header['videoName'], header['videoBucket'], header):
+                writer.put(message_id, index_table_name, item)
+    failed.update(writer.flush())
+
+    for message_id, (message, header, columns, stale) in videos.items():
+        if message_id in failed or not message.get('JobTag'):
+            continue
+        try:
+            item = dedupe.finish(content_table, message['JobTag'], 'SUCCEEDED')
+        except Exception as e:
+            failed[message_id] = '{0}: {1}'.format(type(e).__name__, e)
+            continue
+        links = dedupe.links(item)
+        try:
+            stale_links = [key for bucket, name in links for key in stale_index_keys(name, header)]
+        except Exception as e:
+            failed[message_id] = '{0}: {1}'.format(type(e).__name__, e)
+            continue
+        for key in stale_links:
+            writer.delete(message_id, index_table_name, key)
+        for link in link_items(header['videoName'], links, header):
+            writer.put(message_id, videos_table_name, link)
+        for link in link_index_items(header['videoName'], links, header):
+            writer.put(message_id, index_table_name, link)
+    failed.update(writer.flush())
+
+    for message_id, (message, header, columns, stale) in videos.items():
+        if message_id in failed or not columns:
+            continue
+        try:
+            export_labels(columns, header, [key for table_name, key in stale if table_name == index_table_name])
+        except Exception as e:
+            failed[message_id] = '{0}: {1}'.format(type(e).__name__, e)
+
+    for message_id, error in failed.items():
+        print(json.dumps({'messageId': message_id, 'error': error}))
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+
+def query_labels(event, context):
+    # Videos containing event['label'], optionally above minConfidence and
+    # seen between start and end milliseconds, highest confidence first
+    index_table = resource('dynamodb').Table(os.environ['LABEL_INDEX_TABLE_NAME'])
+    items = labelindex.find_videos(
+        index_table, event['label'],
+        min_confidence=event.get('minConfidence'),
+        start=event.get('start'),
+        end=event.get('end'),
+        limit=event.get('limit', 100))
+
+    return {'label': event['label'], 'videos': [from_item(item) for item in items]}
+
+
+def get_label_appearances(event, context):
+    # Spans of time each label of event['videoName'] is seen in, optionally
+    # only those of event['label'], read from the video the labels are
+    # stored for when it is a linked copy
+    dynamodb = resource('dynamodb')
+    header = dynamodb.Table(os.environ['VIDEOS_TABLE_NAME']).get_item(Key={'videoName': event['videoName']})['Item']
+    items = video_items(dynamodb.Table(os.environ['APPEARANCES_TABLE_NAME']),
+                        header.get('LinkedTo', event['videoName']))
+    appearances = LabelDecoder(header).appearances(items, event.get('label'))
+
+    return {'videoName': event['videoName'], 'appearances': from_item(appearances)}
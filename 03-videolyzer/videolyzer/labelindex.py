@@ -0,0 +1,76 @@
+"""Inverted Label Index
+
+    The index table holds one item per label and video, keyed by labelName
+    and videoName, with the label's highest confidence in the video, its
+    first and last timestamps and how often it was seen. The ByConfidence
+    local secondary index sorts the videos of a label by confidence, so
+    "which videos contain X above 80%" is a single Query.
+"""
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Key
+
+from labels import LabelDecoder
+
+
+INDEX_NAME = 'ByConfidence'
+
+
+def index_items(video_name, video_bucket, header, linked_to=None):
+    """Index items for every label in a video header"""
+    precision = Decimal(str(header['Encoding']['ConfidencePrecision']))
+    for label in LabelDecoder(header).summary():
+        item = {
+            'labelName': label['Name'],
+            'videoName': video_name,
+            'videoBucket': video_bucket,
+            'Confidence': (Decimal(str(label['Confidence'])) / precision).quantize(1) * precision,
+            'FirstTimestamp': label['FirstTimestamp'],
+            'LastTimestamp': label['LastTimestamp'],
+            'Count': label['Count']
+        }
+        if linked_to:
+            item['LinkedTo'] = linked_to
+        yield item
+
+
+def stale_keys(video_name, old_header, header):
+    """Keys of index items for labels in old_header, the header a video had before, that header lacks"""
+    if not old_header or 'Summary' not in old_header:
+        return []
+    names = {label['Name'] for label in LabelDecoder(header).summary()}
+    return [{'labelName': label['Name'], 'videoName': video_name}
+            for label in LabelDecoder(old_header).summary() if label['Name'] not in names]
+
+
+def find_videos(table, label, min_confidence=None, start=None, end=None, limit=None):
+    """Index items for label, highest confidence first
+
+    Only videos where the label reaches min_confidence and is seen between
+    start and end milliseconds are returned.
+    """
+    key = Key('labelName').eq(label)
+    if min_confidence is not None:
+        key = key & Key('Confidence').gte(Decimal(str(min_confidence)))
+    params = {'IndexName': INDEX_NAME, 'KeyConditionExpression': key, 'ScanIndexForward': False}
+
+    conditions = []
+    if start is not None:
+        conditions.append(Attr('LastTimestamp').gte(start))
+    if end is not None:
+        conditions.append(Attr('FirstTimestamp').lte(end))
+    if conditions:
+        params['FilterExpression'] = conditions[0] if len(conditions) == 1 else conditions[0] & conditions[1]
+
+    found = 0
+    while True:
+        page = table.query(**params)
+        for item in page['Items']:
+            yield item
+            found += 1
+            if limit and found >= limit:
+                return
+        if 'LastEvaluatedKey' not in page:
+            return
+        params['ExclusiveStartKey'] = page['LastEvaluatedKey']
@@ -0,0 +1,226 @@
+"""Compact Columnar Encoding for Rekognition Labels
+
+    Each segment item stores its labels as packed little-endian arrays
+    (timestamps, interned name and parent ids, quantized confidences and
+    instance bounding boxes) in DynamoDB binary attributes. Label names and
+    sets of parents are interned once per video and kept in the header item
+    together with a summary of every label, its highest confidence, first
+    and last timestamps and number of occurrences.
+
+    Appearances, the spans of time each label is seen in with short gaps
+    between sightings bridged and low confidence sightings left out, grow
+    with the length of the video, so they are packed the same way into
+    items of their own keyed by the start of their first span, keeping the
+    header well under the DynamoDB item size limit.
+"""
+import sys
+from array import array
+
+
+ENCODING_VERSION = 1
+BOX_FIELDS = ('Width', 'Height', 'Left', 'Top')
+
+
+def pack(typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class LabelAppearances:
+    """Collapses time sorted label sightings into spans of time per label"""
+
+    def __init__(self, gap_millis=1000, min_confidence=50.0):
+        """Creates a LabelAppearances object"""
+        self.gap_millis = gap_millis
+        self.min_confidence = min_confidence
+        self.open = {}
+        self.closed = []
+
+    def add(self, timestamps, name_ids, confidences):
+        """Extend or start appearances with columns of sightings in timestamp order"""
+        for timestamp, name_id, confidence in zip(timestamps, name_ids, confidences):
+            if confidence < self.min_confidence:
+                continue
+            current = self.open.get(name_id)
+            if current and timestamp - current[1] <= self.gap_millis:
+                current[1] = timestamp
+                current[2] = max(current[2], confidence)
+            else:
+                if current:
+                    self.closed.append((current[0], name_id, current[1], current[2]))
+                self.open[name_id] = [timestamp, timestamp, confidence]
+
+    def spans(self):
+        """(start, name id, end, highest confidence) of every appearance ordered by start"""
+        spans = self.closed + [(start, name_id, end, confidence)
+                               for name_id, (start, end, confidence) in self.open.items()]
+        return sorted(spans)
+
+
+class LabelEncoder:
+    """Interns label names for a video and packs segments of labels into columns"""
+
+    def __init__(self, precision=0.01, gap_millis=1000, min_confidence=50.0):
+        """Creates a LabelEncoder object"""
+        self.precision = precision
+        self.confidence_type = 'H' if 100 / precision <= 65535 else 'I'
+        self.names = []
+        self.ids = {}
+        self.parent_sets = []
+        self.parent_ids = {}
+        self.summary = {}
+        self.appearances = LabelAppearances(gap_millis, min_confidence)
+
+    def name_id(self, name):
+        """Id of a label name, interning it on first sight"""
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def parents_id(self, label):
+        """Id of the set of parents of a label, interning it on first sight"""
+        parents = tuple(sorted(self.name_id(p['Name']) for p in label.get('Parents', [])))
+        if parents not in self.parent_ids:
+            self.parent_ids[parents] = len(self.parent_sets)
+            self.parent_sets.append(list(parents))
+        return self.parent_ids[parents]
+
+    def summarize(self, timestamp, name_id, confidence):
+        first, last, highest, count = self.summary.get(name_id, (timestamp, timestamp, 0, 0))
+        self.summary[name_id] = (min(first, timestamp), max(last, timestamp),
+                                 max(highest, confidence), count + 1)
+
+    def quantize(self, confidences):
+        scale = 1 / self.precision
+        return pack(self.confidence_type, [int(c * scale + 0.5) for c in confidences])
+
+    def encode(self, labels):
+        """Columns for a list of labels as returned by get_label_detection"""
+        rows = [l['Label'] for l in labels]
+        for label in labels:
+            self.summarize(label['Timestamp'], self.name_id(label['Label']['Name']),
+                           label['Label']['Confidence'])
+        instances = [(row, i) for row, label in enumerate(rows) for i in label.get('Instances', [])]
+        self.appearances.add([l['Timestamp'] for l in labels], [self.ids[label['Name']] for label in rows],
+                             [label['Confidence'] for label in rows])
+        return {
+            'Timestamps': pack('I', [l['Timestamp'] for l in labels]),
+            'Names': pack('H', [self.name_id(label['Name']) for label in rows]),
+            'Parents': pack('H', [self.parents_id(label) for label in rows]),
+            'Confidence': self.quantize([label['Confidence'] for label in rows]),
+            'InstanceRows': pack('H', [row for row, _ in instances]),
+            'InstanceConfidence': self.quantize([i['Confidence'] for _, i in instances]),
+            'Boxes': pack('f', [i['BoundingBox'][f] for _, i in instances for f in BOX_FIELDS])
+        }
+
+    def appearance_items(self, per_item=1000):
+        """Appearances packed into items of up to per_item spans, keyed by the start of their first span"""
+        spans = self.appearances.spans()
+        last_key = None
+        for first in range(0, len(spans), per_item):
+            chunk = spans[first:first + per_item]
+            last_key = chunk[0][0] if last_key is None else max(chunk[0][0], last_key + 1)
+            yield {
+                'spanStart': last_key,
+                'Names': pack('H', [name_id for _, name_id, _, _ in chunk]),
+                'Start': pack('I', [start for start, _, _, _ in chunk]),
+                'End': pack('I', [end for _, _, end, _ in chunk]),
+                'Confidence': self.quantize([confidence for _, _, _, confidence in chunk])
+            }
+
+    def header(self):
+        """Header attributes needed to decode the segments and appearances of this video"""
+        ids = sorted(self.summary)
+        return {
+            'LabelNames': self.names,
+            'LabelParents': self.parent_sets,
+            'Summary': {
+                'Names': pack('H', ids),
+                'First': pack('I', [self.summary[i][0] for i in ids]),
+                'Last': pack('I', [self.summary[i][1] for i in ids]),
+                'Confidence': self.quantize([self.summary[i][2] for i in ids]),
+                'Count': pack('I', [self.summary[i][3] for i in ids])
+            },
+            'Appearances': {
+                'Spans': len(self.appearances.spans()),
+                'GapMillis': self.appearances.gap_millis,
+                'MinConfidence': str(self.appearances.min_confidence)
+            },
+            'Encoding': {
+                'Version': ENCODING_VERSION,
+                'ConfidencePrecision': str(self.precision),
+                'ConfidenceType': self.confidence_type
+            }
+        }
+
+
+class LabelDecoder:
+    """Turns packed segment items back into columns or label dicts"""
+
+    def __init__(self, header):
+        """Creates a LabelDecoder object from a video header item"""
+        self.names = list(header['LabelNames'])
+        self.parent_sets = [[self.names[int(n)] for n in p] for p in header['LabelParents']]
+        self.precision = float(header['Encoding']['ConfidencePrecision'])
+        self.confidence_type = header['Encoding']['ConfidenceType']
+        self.summary_columns = header.get('Summary')
+
+    def columns(self, item):
+        """Timestamps, name ids and confidences of a segment as arrays"""
+        return (unpack('I', item['Timestamps']),
+                unpack('H', item['Names']),
+                [c * self.precision for c in unpack(self.confidence_type, item['Confidence'])])
+
+    def labels(self, item):
+        """Labels of a segment in the shape get_label_detection returns them"""
+        timestamps, names, confidences = self.columns(item)
+        instances = [[] for _ in timestamps]
+        boxes = unpack('f', item['Boxes'])
+        instance_confidence = unpack(self.confidence_type, item['InstanceConfidence'])
+        parents = unpack('H', item['Parents'])
+        for n, row in enumerate(unpack('H', item['InstanceRows'])):
+            instances[row].append({
+                'BoundingBox': dict(zip(BOX_FIELDS, boxes[n * 4:n * 4 + 4])),
+                'Confidence': instance_confidence[n] * self.precision
+            })
+        return [{'Timestamp': timestamps[row], 'Label': {
+                    'Name': self.names[names[row]],
+                    'Confidence': confidences[row],
+                    'Instances': instances[row],
+                    'Parents': [{'Name': p} for p in self.parent_sets[parents[row]]]}}
+                for row in range(len(timestamps))]
+
+    def summary(self):
+        """Name, highest confidence, first and last timestamps and count of every label in the video"""
+        if not self.summary_columns:
+            return []
+        columns = self.summary_columns
+        return [{'Name': self.names[name], 'Confidence': confidence * self.precision,
+                 'FirstTimestamp': first, 'LastTimestamp': last, 'Count': count}
+                for name, first, last, confidence, count in zip(
+                    unpack('H', columns['Names']), unpack('I', columns['First']),
+                    unpack('I', columns['Last']), unpack(self.confidence_type, columns['Confidence']),
+                    unpack('I', columns['Count']))]
+
+    def appearances(self, items, name=None):
+        """Name, start and end timestamps and highest confidence of every appearance ordered by start
+
+        items are the appearance items of the video in spanStart order."""
+        spans = [{'Name': self.names[name_id], 'Start': start, 'End': end,
+                  'Confidence': confidence * self.precision}
+                 for item in items
+                 for name_id, start, end, confidence in zip(
+                     unpack('H', item['Names']), unpack('I', item['Start']),
+                     unpack('I', item['End']), unpack(self.confidence_type, item['Confidence']))]
+        return [span for span in spans if name is None or span['Name'] == name]
@@ -0,0 +1,141 @@
+"""Rekognition Job Scheduling with Backpressure
+
+    JobScheduler.submit retries a job submission with exponential backoff
+    while Rekognition reports its concurrent job limit, and JobScheduler.run
+    feeds a stream of videos through it keeping at most max_in_flight jobs
+    running, with progress saved to a BackfillState file so an interrupted
+    run picks up where it stopped.
+"""
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+
+LIMIT_ERRORS = ('LimitExceededException', 'ThrottlingException',
+                'ProvisionedThroughputExceededException')
+
+
+class BackfillState:
+    """Per video progress saved to a local JSON file"""
+
+    DEFAULT_PATH = '~/.videolyzer/backfill.json'
+
+    def __init__(self, path=None):
+        """Creates a BackfillState object"""
+        self.path = Path(path or self.DEFAULT_PATH).expanduser()
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.videos = json.load(f)
+        except (OSError, ValueError):
+            self.videos = {}
+
+    def get(self, name):
+        with self._lock:
+            return self.videos.get(name)
+
+    def put(self, name, status, job_id=None):
+        with self._lock:
+            self.videos[name] = {'Status': status, 'JobId': job_id}
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.videos, f)
+        os.replace(tmp, self.path)
+
+
+class JobScheduler:
+    """Submits jobs with backoff on limit errors and keeps at most max_in_flight running"""
+
+    def __init__(self, max_in_flight=4, retries=8, backoff=1.0, max_backoff=60.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        """Creates a JobScheduler object"""
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.clock = clock
+
+    def submit(self, func, *args, deadline=None, **kwargs):
+        """Call func, retrying limit errors with jittered exponential backoff until retries or deadline run out"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in LIMIT_ERRORS or attempt >= self.retries:
+                    raise e
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if deadline is not None and self.clock() + delay > deadline:
+                    raise e
+                attempt += 1
+                self.sleep(delay)
+
+    def run(self, videos, start, job_status, state, poll=30.0, report=print):
+        """Start a job for every (name, args) in videos, keeping max_in_flight running
+
+        start(*args) returns a job id, or None when no job was needed, and is
+        expected to send its request through submit; job_status(job_id)
+        returns the Rekognition JobStatus.
+        """
+        counts = {'SUBMITTED': 0, 'SKIPPED': 0, 'SUCCEEDED': 0, 'FAILED': 0, 'DONE': 0}
+        in_flight = {}
+
+        for name, args in videos:
+            saved = state.get(name)
+            if saved and saved['Status'] in ('SUCCEEDED', 'SKIPPED'):
+                counts['DONE'] += 1
+                continue
+            if len(in_flight) >= self.max_in_flight:
+                self.wait(in_flight, job_status, state, counts, poll, report, self.max_in_flight)
+            if saved and saved['Status'] == 'IN_PROGRESS':
+                in_flight[name] = saved['JobId']
+                continue
+
+            job_id = self.start(start, args, in_flight, job_status, state, counts, poll, report)
+            if job_id:
+                state.put(name, 'IN_PROGRESS', job_id)
+                in_flight[name] = job_id
+                counts['SUBMITTED'] += 1
+                report("Started {0} as job {1}".format(name, job_id))
+            else:
+                state.put(name, 'SKIPPED')
+                counts['SKIPPED'] += 1
+                report("Skipped {0}, labels already exist or are being made".format(name))
+
+        self.wait(in_flight, job_status, state, counts, poll, report, 1)
+        return counts
+
+    def start(self, start, args, in_flight, job_status, state, counts, poll, report):
+        """Call start(*args), waiting for a running job to finish whenever the job limit is hit"""
+        while True:
+            try:
+                return start(*args)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in LIMIT_ERRORS or not in_flight:
+                    raise e
+                report("Job limit reached with {0} running, waiting for one to finish".format(len(in_flight)))
+                self.wait(in_flight, job_status, state, counts, poll, report, len(in_flight))
+
+    def wait(self, in_flight, job_status, state, counts, poll, report, limit):
+        """Poll running jobs until fewer than limit are left"""
+        while True:
+            for name, job_id in list(in_flight.items()):
+                status = self.submit(job_status, job_id)
+                if status != 'IN_PROGRESS':
+                    del in_flight[name]
+                    state.put(name, status, job_id)
+                    counts[status] = counts.get(status, 0) + 1
+                    report("Job {0} for {1} {2}".format(job_id, name, status))
+            if len(in_flight) < limit:
+                return
+            self.sleep(poll)